@@ -0,0 +1,33 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+# mkstemp() creates private files; written files get the permissions open() would give them
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+@contextmanager
+def atomic_write(path, mode="w", fsync=False):
+    """
+    Write the file at path atomically: the block writes to a temporary file in the same
+    directory, which is renamed over path once the block is done, so readers (and a run that
+    was interrupted) only ever see a complete file. If the block raises, the temporary file
+    is removed and path is left as it was.
+
+    mode is "w" (utf-8 text) or "wb". With fsync=True the data is on disk before the rename.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}-", suffix=".tmp", dir=directory)
+    try:
+        os.chmod(tmp_path, 0o666 & ~_umask)
+        with os.fdopen(fd, mode, encoding=None if "b" in mode else "utf-8") as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
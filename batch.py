@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from main import validate_args, run_ise, check_positive_int, worker_initargs
+from models import Models
+from resources import ISEResources, resource_options
+
+
+class ThreadOutput:
+    """
+    Stand-in for sys.stdout that sends what each thread prints to that thread's own
+    stream (its job log), and everything else to the original stream.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+
+    def set_stream(self, stream):
+        self._local.stream = stream
+
+    def stream(self):
+        return getattr(self._local, "stream", None) or self.default
+
+    def write(self, data):
+        return self.stream().write(data)
+
+    def flush(self):
+        self.stream().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+def read_jobs(path):
+    """
+    Read one job per line: {"method": "spanbert" | "gemini", "r": 2, "t": 0.7, "q": "...", "k": 10}.
+    A job may also set "id" (its result file name) and "options", a list of extra main.py options.
+    """
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            job.setdefault("id", f"job-{line_number:04d}")
+            jobs.append(job)
+    return jobs
+
+
+# Options naming a file of a single run, which jobs can only set in their own options
+per_run_files = {"checkpoint": "--checkpoint", "resume": "--resume", "profile_iteration": "--profile-iteration"}
+
+# A job's --profile-iteration without --profile-output writes <out dir>/<id>.prof instead
+default_profile_output = "iteration.prof"
+
+
+def job_argv(job, keys, options):
+    """
+    The main.py command line of a job: the batch's keys and options, then the job's own options.
+    """
+    return ([f"-{job['method']}"] + keys + [str(job["r"]), str(job["t"]), job["q"], str(job["k"])]
+            + options + [str(option) for option in job.get("options", [])])
+
+
+def shared_option_mismatches(args, shared_args, models):
+    """
+    The options of a job that differ from the ones the shared ISEResources (and worker pool)
+    were built from, and so would be silently ignored.
+    """
+    mismatches = ["--" + name.replace("_", "-") for name in resource_options if getattr(args, name) != getattr(shared_args, name)]
+    if args.workers and (args.workers, worker_initargs(args, models)) != (shared_args.workers, worker_initargs(shared_args, models)):
+        mismatches.append("the worker settings (--workers, --spanbert-backend, --spanbert-threads, ...)")
+    return mismatches
+
+
+def run_job(job, keys, options, models, resources, out_dir, shared_args):
+    """
+    Run one job with the shared models and resources and write <id>.json (its results) and
+    <id>.log (everything it printed) to out_dir. Returns True if the job finished.
+    """
+    result_path = os.path.join(out_dir, f"{job['id']}.json")
+    log_path = os.path.join(out_dir, f"{job['id']}.log")
+    record = {"job": job}
+    with open(log_path, "w", encoding="utf-8") as log:
+        sys.stdout.set_stream(log)
+        sys.stderr.set_stream(log)
+        try:
+            # Same validation as the command line; argparse exits on invalid arguments
+            args = validate_args(job_argv(job, keys, options))
+            if args.metrics is not None:
+                raise ValueError("--metrics can't be used in a batch: the timers and counters are shared by all concurrent jobs")
+            mismatches = shared_option_mismatches(args, shared_args, models)
+            if mismatches:
+                raise ValueError(f"{', '.join(mismatches)} must be the same for every job; set them in the batch options")
+            if args.profile_iteration is not None and args.profile_output == default_profile_output:
+                args.profile_output = os.path.join(out_dir, f"{job['id']}.prof")
+            results = run_ise(args, models, resources)
+            record["results"] = results.as_records()
+        except SystemExit:
+            record["error"] = "invalid arguments"
+        except Exception as e:
+            traceback.print_exc()
+            record["error"] = repr(e)
+        finally:
+            sys.stdout.set_stream(None)
+            sys.stderr.set_stream(None)
+
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    return "error" not in record
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run many ISE jobs from a JSONL file concurrently, sharing models, caches and fetched pages. "
+                    "Options not listed here (ex. --page-cache, --spacy-fast) are passed on to every job; "
+                    "put them after the API keys."
+    )
+    parser.add_argument("jobs", type=str, help="JSONL file with one job per line")
+    parser.add_argument("google_search_api_key", type=str, help="Google Custom Search Engine JSON API Key")
+    parser.add_argument("google_engine_id", type=str, help="Google Engine ID")
+    parser.add_argument("google_gemini_api_key", type=str, help="Google Gemini API Key")
+    parser.add_argument("--out-dir", dest="out_dir", type=str, default="batch_results",
+                        help="Directory the per-job result and log files are written to (default: batch_results)")
+    parser.add_argument("--concurrency", type=check_positive_int, default=4,
+                        help="Number of jobs running at once (default: 4)")
+    batch_args, options = parser.parse_known_args()
+    keys = [batch_args.google_search_api_key, batch_args.google_engine_id, batch_args.google_gemini_api_key]
+
+    # Shared settings (caches, fetch workers, Gemini quota) come from the options every job gets
+    shared_args = validate_args(["-spanbert"] + keys + ["1", "0", "batch", "1"] + options)
+    for name, flag in per_run_files.items():
+        if getattr(shared_args, name) is not None:
+            parser.error(f"{flag} would make every job write the same file; put it in the options of a job")
+    if shared_args.record is not None:
+        parser.error("--record can't be used in a batch: concurrent jobs would record into one fixture directory")
+    if shared_args.metrics is not None:
+        parser.error("--metrics can't be used in a batch: the timers and counters are shared by all concurrent jobs")
+
+    jobs = read_jobs(batch_args.jobs)
+    os.makedirs(batch_args.out_dir, exist_ok=True)
+    models = Models()
+    resources = ISEResources(shared_args, shared=True, max_connections=shared_args.fetch_workers * batch_args.concurrency)
+
+    sys.stdout = ThreadOutput(sys.stdout)
+    sys.stderr = ThreadOutput(sys.stderr)
+    try:
+        print(f"Running {len(jobs)} jobs, {batch_args.concurrency} at a time ...")
+        with ThreadPoolExecutor(max_workers=batch_args.concurrency) as executor:
+            futures = [executor.submit(run_job, job, keys, options, models, resources, batch_args.out_dir, shared_args) for job in jobs]
+            for job, future in zip(jobs, futures):
+                print(f"{job['id']}: {'done' if future.result() else 'failed'}")
+    finally:
+        sys.stdout = sys.stdout.default
+        sys.stderr = sys.stderr.default
+        resources.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Micro-benchmark of candidate pair generation on entity-dense text.
+
+Compares the original create_entity_pairs() + type filter done in extract_relations()
+against create_candidate_pairs(), checks that both produce exactly the same candidate
+pairs and prints the time spent by each.
+
+Usage: python3 benchmarks/bench_entity_pairs.py [--repeat N] [--sentences N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import spacy
+from spacy_help_functions import create_entity_pairs, create_candidate_pairs
+
+entities_of_interest = ["ORGANIZATION", "PERSON", "LOCATION", "CITY", "STATE_OR_PROVINCE", "COUNTRY"]
+relation_requirements = {
+        "Schools_Attended": {"subj": "PERSON", "obj": ["ORGANIZATION"]},
+        "Work_For": {"subj": "PERSON", "obj": ["ORGANIZATION"]},
+        "Live_In": {"subj": "PERSON", "obj": ["LOCATION", "CITY", "STATE_OR_PROVINCE", "COUNTRY"]},
+        "Top_Member_Employees": {"subj": "ORGANIZATION", "obj": ["PERSON"]}
+    }
+
+people = ["Bill Gates", "Paul Allen", "Melinda French", "Satya Nadella", "Steve Ballmer", "Jeff Bezos", "Sundar Pichai"]
+orgs = ["Microsoft", "Harvard University", "Amazon", "Google", "the Gates Foundation", "Princeton University", "IBM"]
+places = ["Seattle", "Washington", "New York City", "Albuquerque", "California", "London"]
+templates = [
+    "{p1} and {p2} founded {o1} in {l1} before moving to {l2}, where {p3} joined {o2}.",
+    "{p1}, who attended {o1} with {p2}, later worked for {o2} and {o3} in {l1}.",
+    "{o1} named {p1} chief executive, replacing {p2}, while {p3} stayed at {o2} in {l1}, {l2}.",
+    "After leaving {o1}, {p1} lived in {l1} and advised {o2}, {o3} and {p2}.",
+]
+
+
+def make_text(n_sentences, seed=0):
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(n_sentences):
+        template = rng.choice(templates)
+        sentences.append(template.format(
+            p1=rng.choice(people), p2=rng.choice(people), p3=rng.choice(people),
+            o1=rng.choice(orgs), o2=rng.choice(orgs), o3=rng.choice(orgs),
+            l1=rng.choice(places), l2=rng.choice(places),
+        ))
+    return " ".join(sentences)
+
+
+def original_candidates(sentence, requirement):
+    # The candidate generation extract_relations() used to do
+    candidate_pairs = []
+    for ep in create_entity_pairs(sentence, entities_of_interest):
+        pair1 = {"tokens": ep[0], "subj": ep[1], "obj": ep[2]}
+        pair2 = {"tokens": ep[0], "subj": ep[2], "obj": ep[1]}
+        if pair1["subj"][1] == requirement["subj"] and pair1["obj"][1] in requirement["obj"]:
+            candidate_pairs.append(pair1)
+        if pair2["subj"][1] == requirement["subj"] and pair2["obj"][1] in requirement["obj"]:
+            candidate_pairs.append(pair2)
+    return candidate_pairs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--sentences", type=int, default=200)
+    parser.add_argument("--model", type=str, default="en_core_web_lg")
+    args = parser.parse_args()
+
+    nlp = spacy.load(args.model)
+    doc = nlp(make_text(args.sentences))
+    sentences = list(doc.sents)
+    n_ents = sum(len(sentence.ents) for sentence in sentences)
+    print(f"{len(sentences)} sentences, {n_ents} entities")
+
+    for relation, requirement in relation_requirements.items():
+        expected = [original_candidates(sentence, requirement) for sentence in sentences]
+        got = [create_candidate_pairs(sentence, entities_of_interest, requirement) for sentence in sentences]
+        assert expected == got, f"candidate pairs differ for {relation}"
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for sentence in sentences:
+                original_candidates(sentence, requirement)
+        original_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for sentence in sentences:
+                create_candidate_pairs(sentence, entities_of_interest, requirement)
+        new_time = time.perf_counter() - start
+
+        n_pairs = sum(len(pairs) for pairs in got)
+        print(f"{relation:<22} {n_pairs:>6} pairs | create_entity_pairs + filter: {original_time:.3f}s"
+              f" | create_candidate_pairs: {new_time:.3f}s | speedup: {original_time / new_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Parity check between the BeautifulSoup extractor (html_to_text) and the streaming
+extractor (streaming_html_to_text) on a directory of saved html pages.
+
+Every page is fed to the streaming extractor in small chunks, for several max_length
+values, and the two texts must be identical.
+
+Usage: python3 benchmarks/check_html_parity.py [fixtures dir] [--chunk-size N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from web_fetch import html_to_text, streaming_html_to_text
+
+default_fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "html")
+
+
+def chunked(html, chunk_size):
+    for start in range(0, len(html), chunk_size):
+        yield html[start:start + chunk_size]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fixtures", nargs="?", default=default_fixtures)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    args = parser.parse_args()
+
+    mismatches = 0
+    soup_time = stream_time = 0.0
+    for name in sorted(os.listdir(args.fixtures)):
+        if not name.endswith((".html", ".htm")):
+            continue
+        with open(os.path.join(args.fixtures, name), encoding="utf-8", errors="replace") as f:
+            html = f.read()
+
+        for max_length in (100, 1000, 10000, 1000000):
+            start = time.perf_counter()
+            expected = html_to_text(html, max_length)
+            soup_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            got, _, _ = streaming_html_to_text(chunked(html, args.chunk_size), max_length)
+            stream_time += time.perf_counter() - start
+
+            if got != expected:
+                mismatches += 1
+                prefix = 0
+                while prefix < min(len(got), len(expected)) and got[prefix] == expected[prefix]:
+                    prefix += 1
+                print(f"MISMATCH {name} (max_length={max_length}) at character {prefix}:")
+                print(f"\tBeautifulSoup: {expected[max(0, prefix - 40):prefix + 40]!r}")
+                print(f"\tStreaming:     {got[max(0, prefix - 40):prefix + 40]!r}")
+            else:
+                print(f"ok       {name} (max_length={max_length}, {len(got)} characters)")
+
+    print(f"\nBeautifulSoup: {soup_time:.3f}s | streaming: {stream_time:.3f}s | mismatches: {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
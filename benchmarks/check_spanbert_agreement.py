@@ -0,0 +1,143 @@
+"""
+Agreement check between the reference SpanBERT backend (full-precision torch) and the
+optimized CPU backends (--spanbert-backend int8 / onnx) on a fixed set of candidate pairs.
+
+The candidate pairs are built like main.py builds them, for every relation at once, from a
+directory of saved pages: either html files (ex. benchmarks/fixtures/html) or a --record
+fixture directory (its pages/ records). For every backend it reports
+    - how often the argmax relation differs from the reference,
+    - how often a thresholded (subj, obj) decision differs, i.e. whether the pair would be
+      added to the results of a relation at threshold t (lost: only the reference adds it,
+      gained: only the backend adds it),
+    - the largest confidence difference where both predict the same relation,
+    - pairs/s of each backend.
+
+Usage: python3 benchmarks/check_spanbert_agreement.py [pages dir] [--backends int8,onnx] [--t 0.7]
+                                                      [--threads N] [--max-decision-diff 0.01]
+Exits with 1 if a backend's decision disagreement rate is above --max-decision-diff.
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import entities_of_interest, relation_requirements, relation_map, internal_map
+from models import Models
+from spacy_help_functions import create_candidate_pairs, matches_requirement
+from spanbert_backends import spanbert_backends
+from web_fetch import html_to_text
+
+default_pages = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "html")
+
+
+def read_pages(path):
+    """
+    The html of every saved page in path, in a fixed order.
+    """
+    pages_dir = os.path.join(path, "pages")
+    if os.path.isdir(pages_dir):
+        # A FixtureStore directory: keep the successful responses
+        for name in sorted(os.listdir(pages_dir)):
+            with open(os.path.join(pages_dir, name), encoding="utf-8") as f:
+                record = json.load(f)
+            if record["status"] == 200:
+                yield base64.b64decode(record["body"]).decode("utf-8", errors="replace")
+        return
+
+    for name in sorted(os.listdir(path)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(path, name), encoding="utf-8", errors="replace") as f:
+                yield f.read()
+
+
+def candidate_pairs(nlp, pages, max_pairs=None):
+    """
+    The candidate pairs of every sentence of the pages, for the union of all relations.
+    """
+    requirements = [relation_requirements[name] for name in relation_map.values()]
+    texts = [html_to_text(html, 10000) for html in pages]
+    pairs = []
+    for doc in nlp.pipe(texts):
+        for sentence in doc.sents:
+            pairs.extend(create_candidate_pairs(sentence, entities_of_interest, requirements))
+            if max_pairs and len(pairs) >= max_pairs:
+                return pairs[:max_pairs]
+    return pairs
+
+
+def predict(spanbert, pairs, batch_size):
+    """
+    Predictions for every pair and the seconds they took.
+    """
+    preds = []
+    start = time.perf_counter()
+    for i in range(0, len(pairs), batch_size):
+        preds.extend(tuple(pred) for pred in spanbert.predict(pairs[i:i + batch_size]))
+    return preds, time.perf_counter() - start
+
+
+def decisions(pairs, preds, t):
+    """
+    The (relation, pair index) combinations that would be added to a relation's results.
+    """
+    added = set()
+    for i, (pair, (label, confidence)) in enumerate(zip(pairs, preds)):
+        for r, name in relation_map.items():
+            if label == internal_map[r] and confidence >= t and matches_requirement(pair, relation_requirements[name]):
+                added.add((r, i))
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pages", nargs="?", default=default_pages)
+    parser.add_argument("--backends", type=str, default="int8,onnx", help="Comma-separated backends to compare to torch")
+    parser.add_argument("--t", type=float, default=0.7, help="Threshold of the (subj, obj) decisions (default: 0.7)")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads of every backend")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-pairs", type=int, default=None, help="Only check the first N candidate pairs")
+    parser.add_argument("--max-decision-diff", type=float, default=0.01,
+                        help="Fail if more than this fraction of the decisions differ (default: 0.01)")
+    args = parser.parse_args()
+    backends = [backend for backend in args.backends.split(",") if backend]
+    for backend in backends:
+        if backend not in spanbert_backends or backend == "torch":
+            parser.error(f"not an optimized backend: {backend}")
+
+    models = Models()
+    pairs = candidate_pairs(models.nlp(), read_pages(args.pages), args.max_pairs)
+    if not pairs:
+        print(f"No candidate pairs in {args.pages}")
+        sys.exit(1)
+    print(f"{len(pairs)} candidate pairs")
+
+    reference, seconds = predict(models.spanbert("torch", args.threads), pairs, args.batch_size)
+    reference_added = decisions(pairs, reference, args.t)
+    print(f"torch    | pairs/s: {len(pairs) / seconds:8.1f} | {len(reference_added)} decisions at t={args.t}")
+
+    failed = False
+    for backend in backends:
+        preds, seconds = predict(models.spanbert(backend, args.threads), pairs, args.batch_size)
+        added = decisions(pairs, preds, args.t)
+
+        label_diff = sum(1 for ref, pred in zip(reference, preds) if ref[0] != pred[0])
+        confidence_diff = max((abs(ref[1] - pred[1]) for ref, pred in zip(reference, preds) if ref[0] == pred[0]), default=0.0)
+        lost = len(reference_added - added)
+        gained = len(added - reference_added)
+        decision_rate = (lost + gained) / max(len(reference_added | added), 1)
+        failed = failed or decision_rate > args.max_decision_diff
+
+        print(f"{backend:8s} | pairs/s: {len(pairs) / seconds:8.1f} | "
+              f"argmax differs: {label_diff} ({label_diff / len(pairs):.2%}) | "
+              f"decisions differ: {lost + gained} ({decision_rate:.2%}; {lost} lost, {gained} gained) | "
+              f"max confidence diff: {confidence_diff:.4f}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Recall loss of the Gemini relevance filter (--gemini-prefilter) on recorded pages.
+
+Replays a fixture directory recorded by an unfiltered Gemini run (main.py -gemini ... --record
+<dir>): every recorded page is parsed and annotated again, and its candidate sentences are
+sent through the same Gemini path as main.py, answered from the recorded completions. That
+gives the tuples each candidate sentence contributes without the filter. Each scorer then
+scores the same sentences, and for every threshold the script reports the share of candidate
+sentences (Gemini prompts without batching) that would be kept, and the share of the
+unfiltered tuples that the kept sentences still find (recall).
+
+Use the --relations and --gemini-batch-tokens of the recorded run, so the prompts match the
+recording. Completions that were never recorded (ex. the run used a warm --prediction-cache)
+count as empty answers, and their number is printed.
+
+Usage: python3 benchmarks/eval_gemini_prefilter.py <fixtures dir> [--relations 1,2,3,4]
+           [--gemini-batch-tokens N] [--scorers lexical,spanbert] [--thresholds 0.25,0.5,0.75,1]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import check_relations, entities_of_interest, relation_requirements, relation_map, internal_map
+from fixtures import FixtureStore
+from gemini import GeminiClient, gemini_relations_many, gemini_relations_batched
+from models import Models
+from relevance import LexicalScorer, SpanBERTScorer
+from spacy_help_functions import create_candidate_pairs, matches_requirement
+from spanbert_backends import spanbert_backends
+from web_fetch import make_session, extract_plain_text
+
+
+def recorded_texts(store, session):
+    """
+    The plain text of every recorded page that was downloaded successfully, in a fixed order.
+    """
+    pages_dir = os.path.join(store.path, "pages")
+    for name in sorted(os.listdir(pages_dir)):
+        with open(os.path.join(pages_dir, name), encoding="utf-8") as f:
+            record = json.load(f)
+        if record["status"] != 200:
+            continue
+        page = extract_plain_text(record["url"], session=session)
+        if page is not None and page[0]:
+            yield page[0]
+
+
+def candidate_sentences(nlp, texts, relations):
+    """
+    {relation name: [(sentence, candidate pairs), ...] per page}, chosen like extract_relations().
+    """
+    requirements = {relation_map[r]: relation_requirements[relation_map[r]] for r in relations}
+    candidates = {name: [] for name in requirements}
+    for doc in nlp.pipe(texts):
+        page = {name: [] for name in requirements}
+        for sentence in doc.sents:
+            pairs = create_candidate_pairs(sentence, entities_of_interest, list(requirements.values()))
+            for name, requirement in requirements.items():
+                if any(matches_requirement(pair, requirement) for pair in pairs):
+                    page[name].append((sentence, pairs))
+        for name in requirements:
+            candidates[name].append(page[name])
+    return candidates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fixtures")
+    parser.add_argument("--relations", type=check_relations, default=[1, 2, 3, 4], help="Relations of the recorded run (default: 1,2,3,4)")
+    parser.add_argument("--gemini-batch-tokens", type=int, default=0, help="--gemini-batch-tokens of the recorded run (default: 0)")
+    parser.add_argument("--scorers", type=str, default="lexical", help="Comma-separated scorers: lexical, spanbert (default: lexical)")
+    parser.add_argument("--thresholds", type=str, default="0.25,0.5,0.75,1", help="Comma-separated thresholds to evaluate")
+    parser.add_argument("--spanbert-backend", choices=spanbert_backends, default="torch")
+    parser.add_argument("--spacy-fast", action="store_true")
+    args = parser.parse_args()
+    scorer_names = [name for name in args.scorers.split(",") if name]
+    for name in scorer_names:
+        if name not in ("lexical", "spanbert"):
+            parser.error(f"unknown scorer: {name}")
+    thresholds = [float(value) for value in args.thresholds.split(",") if value]
+
+    store = FixtureStore(args.fixtures, "replay")
+    session = make_session()
+    store.mount(session)
+    client = GeminiClient("replay", fixtures=store)
+    models = Models()
+
+    # Silence the page and Gemini parsing messages
+    with contextlib.redirect_stdout(io.StringIO()):
+        candidates = candidate_sentences(models.nlp(args.spacy_fast), list(recorded_texts(store, session)), args.relations)
+
+        # Tuples of every candidate sentence on the unfiltered path
+        store.misses = 0
+        tuples = {}  # relation name -> [set of tuples per candidate sentence]
+        for name, pages in candidates.items():
+            tuples[name] = []
+            for page in pages:
+                sentences = [sentence for sentence, _ in page]
+                if not sentences:
+                    continue
+                if args.gemini_batch_tokens > 0:
+                    parsed = gemini_relations_batched(client, name, sentences, args.gemini_batch_tokens)
+                else:
+                    parsed = gemini_relations_many(client, name, sentences)
+                for parsed_relations in parsed:
+                    tuples[name].append({tuple(relation) for relation in parsed_relations or []
+                                         if isinstance(relation, list) and len(relation) == 3})
+        misses = store.misses
+    client.close()
+
+    scorers = {}
+    if "lexical" in scorer_names:
+        scorers["lexical"] = LexicalScorer()
+    if "spanbert" in scorer_names:
+        scorers["spanbert"] = SpanBERTScorer(models.spanbert(args.spanbert_backend), {relation_map[r]: internal_map[r] for r in relation_map},
+                                             relation_requirements)
+
+    total_sentences = sum(len(sentence_tuples) for sentence_tuples in tuples.values())
+    all_tuples = {(name, t) for name, sentence_tuples in tuples.items() for found in sentence_tuples for t in found}
+    print(f"{total_sentences} candidate sentences, {len(all_tuples)} distinct tuples without the filter")
+    if misses:
+        print(f"Warning: {misses} completions were not recorded and count as empty answers")
+
+    for scorer_name, scorer in scorers.items():
+        scores = {name: [scorer.scores(sentence, pairs, [name])[0] for page in pages for sentence, pairs in page]
+                  for name, pages in candidates.items()}
+        for threshold in thresholds:
+            kept = 0
+            kept_tuples = set()
+            for name, sentence_scores in scores.items():
+                for score, found in zip(sentence_scores, tuples[name]):
+                    if score >= threshold:
+                        kept += 1
+                        kept_tuples.update((name, t) for t in found)
+            recall = len(kept_tuples) / len(all_tuples) if all_tuples else 1.0
+            print(f"{scorer_name:8s} | threshold: {threshold:4.2f} | sentences sent: {kept:5d} / {total_sentences} "
+                  f"({kept / max(total_sentences, 1):.1%}) | recall: {recall:.1%} ({len(all_tuples) - len(kept_tuples)} tuples lost)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+End-to-end benchmark of the ISE pipeline on fixed seed scenarios, replayed offline.
+
+The scenarios are the runs in transcript_spanBERT.txt and transcript_gemini.txt: Work_For,
+"bill gates microsoft", k=10, with SpanBERT (t=0.7) and with Gemini. Their searches, webpages
+and Gemini completions are recorded once with live keys; every benchmark run then replays
+them, so only the local pipeline (parsing, spaCy, candidate pairs, SpanBERT, ...) is timed.
+
+Usage:
+    python3 benchmarks/run_benchmarks.py --record <google api key> <google engine id> <google gemini api key>
+    python3 benchmarks/run_benchmarks.py [--scenarios spanbert,gemini] [--repeat N] [main.py options ...]
+
+Options not listed here (ex. --spacy-fast, --spanbert-batch page) are passed on to every run.
+Reports wall time, pages/s, sentences/s and tuples/s of each scenario (median of the repeats)
+and the time spent in each pipeline stage (see instrumentation.py).
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main
+from models import Models
+from instrumentation import metrics, Metrics
+
+default_fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "replay")
+
+# name -> (method, r, t, q, k), as in the transcripts
+scenarios = {
+    "spanbert": ("spanbert", 2, 0.7, "bill gates microsoft", 10),
+    "gemini": ("gemini", 2, 0.0, "bill gates microsoft", 10),
+}
+
+
+def scenario_argv(name, keys, fixture_flag, fixtures, options):
+    method, r, t, q, k = scenarios[name]
+    return [f"-{method}"] + keys + [str(r), str(t), q, str(k), fixture_flag, fixtures] + options
+
+
+def run_scenario(argv, models):
+    """
+    Run ISE once and return (seconds, pages, sentences, tuples, stage seconds). The run's
+    output is discarded.
+    """
+    args = main.validate_args(argv)
+    metrics.enable()
+    before = metrics.snapshot()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            results = main.run_ise(args, models)
+            seconds = time.perf_counter() - start
+    finally:
+        metrics.disable()
+    run = Metrics.diff(metrics.snapshot(), before)
+
+    records = results.as_records()
+    tuples = sum(len(r) for r in records.values()) if isinstance(records, dict) else len(records)
+    return seconds, run["counters"].get("pages", 0), run["counters"].get("sentences", 0), tuples, run["seconds"]
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Replay the transcript scenarios and report throughput")
+    parser.add_argument("--record", nargs=3, metavar=("GOOGLE_API_KEY", "ENGINE_ID", "GEMINI_API_KEY"), default=None,
+                        help="Run the scenarios live and save their fixtures instead of benchmarking")
+    parser.add_argument("--fixtures", type=str, default=default_fixtures,
+                        help=f"Fixture directory (default: {default_fixtures})")
+    parser.add_argument("--scenarios", type=str, default=",".join(scenarios),
+                        help=f"Comma-separated scenarios to run (default: {','.join(scenarios)})")
+    parser.add_argument("--repeat", type=main.check_positive_int, default=3, help="Timed runs per scenario (default: 3)")
+    parser.add_argument("--json", dest="json_path", type=str, default=None, help="Also write the report to this JSON file")
+    bench_args, options = parser.parse_known_args()
+    names = [name for name in bench_args.scenarios.split(",") if name]
+    for name in names:
+        if name not in scenarios:
+            parser.error(f"unknown scenario: {name}")
+
+    models = Models()
+
+    if bench_args.record:
+        for name in names:
+            print(f"Recording {name} ...")
+            run_scenario(scenario_argv(name, list(bench_args.record), "--record", bench_args.fixtures, options), models)
+        print(f"Fixtures saved to {bench_args.fixtures}")
+        return
+
+    # Load the models before timing anything
+    keys = ["replay", "replay", "replay"]
+    run_args = main.validate_args(scenario_argv(names[0], keys, "--replay", bench_args.fixtures, options))
+    start = time.perf_counter()
+    models.nlp(run_args.spacy_fast)
+    if any(scenarios[name][0] == "spanbert" for name in names):
+        models.spanbert(run_args.spanbert_backend, run_args.spanbert_threads)
+    print(f"Model load: {time.perf_counter() - start:.2f}s")
+
+    report = {}
+    for name in names:
+        argv = scenario_argv(name, keys, "--replay", bench_args.fixtures, options)
+        runs = [run_scenario(argv, models) for _ in range(bench_args.repeat)]
+        seconds = statistics.median(run[0] for run in runs)
+        _, pages, sentences, tuples, stages = runs[-1]
+        report[name] = {
+            "wall_s": seconds,
+            "pages": pages,
+            "sentences": sentences,
+            "tuples": tuples,
+            "pages_per_s": pages / seconds,
+            "sentences_per_s": sentences / seconds,
+            "tuples_per_s": tuples / seconds,
+            "stage_s": stages,
+        }
+        print(f"{name:10s} | wall: {seconds:7.2f}s | pages/s: {pages / seconds:7.2f} | "
+              f"sentences/s: {sentences / seconds:8.1f} | tuples/s: {tuples / seconds:6.2f} "
+              f"({pages} pages, {sentences} sentences, {tuples} tuples)")
+        print("           | " + ", ".join(f"{stage}: {value:.2f}s" for stage, value in sorted(stages.items(), key=lambda item: -item[1])))
+
+    if bench_args.json_path:
+        with open(bench_args.json_path, "w") as f:
+            json.dump({"options": options, "repeat": bench_args.repeat, "scenarios": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,56 @@
+import json
+from atomic_file import atomic_write
+from result_store import SpanBERTResults, GeminiResults
+
+CHECKPOINT_VERSION = 2
+
+
+def save_checkpoint(path, args, q, query_relation, num_iteration, processed_queries, processed_urls, results, iteration=None, finished=False):
+    """
+    Atomically write the ISE state to path (JSON). results maps each relation number to its
+    results store and query_relation is the relation whose frontier produced q.
+
+    processed_urls must only hold urls whose extraction is complete. iteration describes an
+    iteration in progress: {"query": q, "top_urls": [...]}, so a resumed run reuses its search
+    results and only processes the urls that are not in processed_urls yet.
+    """
+    state = {
+        "version": CHECKPOINT_VERSION,
+        "method": args.extraction_method,
+        "relations": args.relations,
+        "t": args.t,
+        "seed_query": args.q,
+        "k": args.k,
+        "q": q,
+        "query_relation": query_relation,
+        "num_iteration": num_iteration,
+        "processed_queries": sorted(processed_queries),
+        "processed_urls": sorted(processed_urls),
+        "results": {str(r): store.as_records() for r, store in results.items()},
+        "iteration": iteration,
+        "finished": finished,
+    }
+
+    with atomic_write(path, fsync=True) as f:
+        json.dump(state, f, ensure_ascii=False)
+
+
+def load_checkpoint(path, args):
+    """
+    Read a checkpoint written by save_checkpoint() and check it belongs to the same kind of
+    run as args. Returns the state dict with "results" turned back into {relation: results store}.
+    """
+    with open(path, encoding="utf-8") as f:
+        state = json.load(f)
+
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version in {path}: {state.get('version')}")
+    if state["method"] != args.extraction_method or state["relations"] != args.relations:
+        raise ValueError(f"Checkpoint {path} was written by a -{state['method']} run for relations {state['relations']}, "
+                         f"not -{args.extraction_method} for relations {args.relations}")
+
+    store = SpanBERTResults if state["method"] == "spanbert" else GeminiResults
+    state["results"] = {int(r): store.from_records(records) for r, records in state["results"].items()}
+    state["processed_queries"] = set(state["processed_queries"])
+    state["processed_urls"] = set(state["processed_urls"])
+    return state
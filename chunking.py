@@ -0,0 +1,93 @@
+import re
+import time
+from instrumentation import metrics
+
+# Likely sentence ends: ., ! or ? (and closing quotes/brackets) followed by whitespace
+sentence_end_re = re.compile(r"[.!?][\"')\]]*\s+")
+
+
+def sentence_chunks(text, chunk_chars):
+    """
+    Split text into chunks of at most chunk_chars characters that end at a likely sentence
+    end, so spaCy never sees a sentence cut in two. A single "sentence" longer than
+    chunk_chars is cut at the last space before the limit (or at the limit).
+    """
+    start = 0
+    while len(text) - start > chunk_chars:
+        end = start + chunk_chars
+        cut = None
+        for match in sentence_end_re.finditer(text, start, end):
+            cut = match.end()
+        if cut is None:
+            space = text.rfind(" ", start, end)
+            cut = space + 1 if space > start else end
+        yield text[start:cut]
+        start = cut
+    if start < len(text):
+        yield text[start:]
+
+
+def estimate_sentences(text):
+    """
+    Rough number of sentences in text, for progress reporting before spaCy has seen it.
+    """
+    return len(sentence_end_re.findall(text)) + 1
+
+
+class PageBudget:
+    """
+    Per-page limits on the number of sentences and the seconds spent on them (None for no
+    limit), checked before every sentence. Once a limit is hit, stopped says which.
+    """
+
+    def __init__(self, max_sentences=None, max_seconds=None):
+        self.max_sentences = max_sentences
+        self.max_seconds = max_seconds
+        self.started_at = time.perf_counter()
+        self.sentences = 0
+        self.stopped = None
+
+    def exhausted(self):
+        if self.max_sentences is not None and self.sentences >= self.max_sentences:
+            self.stopped = f"Reached the budget of {self.max_sentences} sentences for this page. Skipped the rest."
+        else:
+            self.out_of_time()
+        return self.stopped is not None
+
+    def out_of_time(self):
+        """
+        Whether the time budget is spent. Also checked before the SpanBERT/Gemini calls made
+        at the end of a chunk, for sentences that were already counted.
+        """
+        if self.max_seconds is not None and time.perf_counter() - self.started_at >= self.max_seconds:
+            self.stopped = f"Reached the budget of {self.max_seconds}s for this page after {self.sentences} sentences. Skipped the rest."
+            return True
+        return False
+
+
+def budgeted(sentences, budget):
+    """
+    Pass sentences through until the budget runs out.
+    """
+    for sentence in sentences:
+        if budget.exhausted():
+            metrics.count("budget_stopped_pages")
+            return
+        budget.sentences += 1
+        yield sentence
+
+
+def chunked_sentences(nlp, text, chunk_chars, lock=None):
+    """
+    The sentences of text, annotated one sentence-aligned chunk at a time: only the Doc of
+    the current chunk is kept in memory, however long the page is. Consumers that hold on to
+    sentences flush them when sentence.doc changes (see extract_relations(), extract_page()).
+    """
+    for chunk in sentence_chunks(text, chunk_chars):
+        if lock is not None:
+            with lock, metrics.stage("spacy"):
+                doc = nlp(chunk)
+        else:
+            with metrics.stage("spacy"):
+                doc = nlp(chunk)
+        yield from doc.sents
@@ -0,0 +1,137 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import socketserver
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from main import validate_args, run_ise, check_positive_int
+from models import Models
+from spanbert_backends import spanbert_backends
+from workers import ResidentWorkerPool
+
+
+class ISERequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs with a JSON body {"argv": [...]} holding the same arguments main.py takes, e.g.
+    {"argv": ["-spanbert", "<api key>", "<engine id>", "<gemini key>", "2", "0.7", "bill gates microsoft", "10"]}
+
+    Answers with the extracted tuples and the run's printed output. Jobs run one at a time
+    and all use the models already loaded by the daemon, and --workers jobs its worker processes.
+    """
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(200, {"status": "ok"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length) or b"{}")
+            argv = [str(arg) for arg in job["argv"]]
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": f"expected a JSON object with an 'argv' list: {e}"})
+            return
+
+        log = io.StringIO()
+        with self.server.job_lock, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            # Same validation as the command line; argparse exits on invalid arguments
+            try:
+                args = validate_args(argv)
+            except SystemExit:
+                args = None
+            if args is not None:
+                try:
+                    results = run_ise(args, self.server.models, resident_workers=self.server.workers)
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        # A worker process died; the next --workers job starts new ones
+                        self.server.workers.close()
+                    self.send_json(500, {"error": repr(e), "log": log.getvalue()})
+                    return
+
+        if args is None:
+            self.send_json(400, {"error": "invalid arguments", "log": log.getvalue()})
+            return
+        self.send_json(200, {"results": results.as_records(), "log": log.getvalue()})
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+
+class ISEHTTPServer(HTTPServer):
+    def __init__(self, address, models):
+        super().__init__(address, ISERequestHandler)
+        self.models = models
+        self.workers = ResidentWorkerPool()
+        self.job_lock = threading.Lock()
+
+
+class ISEUnixServer(socketserver.UnixStreamServer):
+    def __init__(self, path, models):
+        super().__init__(path, ISERequestHandler)
+        self.models = models
+        self.workers = ResidentWorkerPool()
+        self.job_lock = threading.Lock()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep spaCy/SpanBERT loaded and serve ISE jobs over HTTP")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=check_positive_int, default=8642, help="Port to listen on (default: 8642)")
+    parser.add_argument("--socket", type=str, default=None, help="Listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--preload", choices=["spacy", "spanbert", "all", "none"], default="all",
+                        help="Models to load before accepting jobs (default: all)")
+    parser.add_argument("--spacy-fast", dest="spacy_fast", action="store_true",
+                        help="Preload the trimmed spaCy pipeline used by --spacy-fast jobs")
+    parser.add_argument("--spanbert-backend", dest="spanbert_backend", choices=spanbert_backends, default="torch",
+                        help="SpanBERT backend to preload (default: torch); jobs can still ask for another one")
+    parser.add_argument("--spanbert-threads", dest="spanbert_threads", type=check_positive_int, default=None,
+                        help="Intra-op threads of the preloaded SpanBERT backend")
+    args = parser.parse_args()
+
+    models = Models()
+    if args.preload in ("spacy", "all"):
+        print("Loading spaCy ...")
+        models.nlp(args.spacy_fast)
+    if args.preload in ("spanbert", "all"):
+        print("Loading SpanBERT ...")
+        models.spanbert(args.spanbert_backend, args.spanbert_threads)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ISEUnixServer(args.socket, models)
+        print(f"Listening on unix socket {args.socket}")
+    else:
+        server = ISEHTTPServer((args.host, args.port), models)
+        print(f"Listening on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.workers.close()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
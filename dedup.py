@@ -0,0 +1,109 @@
+import hashlib
+import re
+
+word_re = re.compile(r"\w+")
+
+
+def stable_hash(text, bits=64):
+    """
+    Hash of text that is the same in every process (unlike hash(), which is salted).
+    """
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=bits // 8).digest(), "big")
+
+
+def simhash(text, shingle_size=4, bits=64):
+    """
+    SimHash signature of text over its word shingles. Texts that share most of their shingles
+    get signatures that differ in only a few bits.
+    """
+    words = word_re.findall(text.lower())
+    if len(words) < shingle_size:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+
+    weights = [0] * bits
+    for shingle in shingles:
+        h = stable_hash(shingle, bits)
+        for bit in range(bits):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+class PageDeduplicator:
+    """
+    Remember the SimHash of every page of a run and spot the pages that are near-duplicates
+    (syndicated copies, mirrors) of one seen before: at most max_distance differing bits.
+
+    Signatures are split into max_distance + 1 bands. Two signatures within max_distance bits
+    share at least one whole band, so only pages with a matching band are compared.
+    """
+
+    def __init__(self, max_distance=3, bits=64):
+        self.max_distance = max_distance
+        self.bits = bits
+        self.num_bands = max_distance + 1
+        self.band_bits = -(-bits // self.num_bands)  # ceil
+        self.bands = [{} for _ in range(self.num_bands)]  # band value -> [(signature, url), ...]
+        self.skipped = 0
+
+    def _band_values(self, signature):
+        mask = (1 << self.band_bits) - 1
+        return [(signature >> (band * self.band_bits)) & mask for band in range(self.num_bands)]
+
+    def duplicate_of(self, url, text):
+        """
+        Return the url of an earlier near-duplicate of text, or None (and remember text).
+        """
+        signature = simhash(text, bits=self.bits)
+        values = self._band_values(signature)
+        for band, value in enumerate(values):
+            for other, other_url in self.bands[band].get(value, []):
+                if bin(signature ^ other).count("1") <= self.max_distance:
+                    self.skipped += 1
+                    return other_url
+
+        for band, value in enumerate(values):
+            self.bands[band].setdefault(value, []).append((signature, url))
+        return None
+
+
+def sentence_key(sentence):
+    """
+    Hash of what the candidate pairs of a sentence are built from: its tokens and entity spans.
+    """
+    key = "\x1f".join(token.text for token in sentence)
+    key += "\x1e" + "\x1f".join(f"{e.start - sentence.start}:{e.end - sentence.start}:{e.label_}" for e in sentence.ents)
+    return stable_hash(key, 128)
+
+
+class SentenceDeduplicator:
+    """
+    Hashes of the sentences already sent to extraction in a run. A sentence is the same
+    when its tokens and its entity spans are (see sentence_key()); the same text with
+    different entities (other page context) is not skipped.
+    """
+
+    def __init__(self):
+        self.seen_hashes = set()
+        self.skipped = 0
+
+    def seen(self, sentence):
+        """
+        True if the sentence was seen before in this run (and count it), else remember it.
+        """
+        return self.seen_key(sentence_key(sentence))
+
+    def forget(self, sentence):
+        """
+        Drop a sentence that was never extracted after all (its page ran out of time), so a
+        later copy of it is processed.
+        """
+        self.seen_hashes.discard(sentence_key(sentence))
+
+    def seen_key(self, key):
+        if key in self.seen_hashes:
+            self.skipped += 1
+            return True
+        self.seen_hashes.add(key)
+        return False
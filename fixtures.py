@@ -0,0 +1,159 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from atomic_file import atomic_write
+
+
+class FixtureStore:
+    """
+    Directory of recorded search results, raw webpage responses and Gemini completions,
+    so a run can be repeated offline with exactly the same inputs (see --record / --replay).
+
+    In "record" mode every live answer is saved as it happens. In "replay" mode nothing
+    touches the network: searches and completions are read back from the store and webpages
+    are served by a requests adapter mounted on the run's session. Each answer is one JSON
+    file named after the hash of its request:
+        searches/<hash>.json  {"q": ..., "num_results": ..., "urls": [...]}
+        pages/<hash>.json     {"url": ..., "status": ..., "headers": {...}, "body": base64}
+        gemini/<hash>.json    {"model": ..., "max_tokens": ..., "prompt": ..., "response": ...}
+    """
+
+    def __init__(self, path, mode):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown fixture mode: {mode}")
+        if mode == "replay" and not os.path.isdir(path):
+            raise ValueError(f"No recorded fixtures in {path}")
+        self.path = path
+        self.mode = mode
+        self.misses = 0  # replayed requests that were never recorded
+        for kind in ("searches", "pages", "gemini"):
+            os.makedirs(os.path.join(path, kind), exist_ok=True)
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def _file(self, kind, *key):
+        digest = hashlib.sha256(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()
+        return os.path.join(self.path, kind, f"{digest}.json")
+
+    def _load(self, kind, *key):
+        try:
+            with open(self._file(kind, *key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+    def _save(self, record, kind, *key):
+        # Written atomically, so concurrent fetches never see half a fixture
+        with atomic_write(self._file(kind, *key)) as f:
+            json.dump(record, f, ensure_ascii=False)
+
+    def search(self, q, num_results, run_search):
+        """
+        The urls process_query() returns for the top num_results results of q: recorded from
+        run_search() or replayed.
+        """
+        if self.replaying:
+            record = self._load("searches", q, num_results)
+            if record is None:
+                raise KeyError(f"No recorded search for query: {q} ({num_results} results)")
+            return record["urls"]
+        urls = run_search()
+        self._save({"q": q, "num_results": num_results, "urls": urls}, "searches", q, num_results)
+        return urls
+
+    def gemini(self, prompt, model_name, max_tokens, run_completion):
+        """
+        The completion get_gemini_completion() returns for prompt: recorded from
+        run_completion() or replayed ("" if it was never recorded, like a failed call).
+        """
+        if self.replaying:
+            record = self._load("gemini", model_name, max_tokens, prompt)
+            return record["response"] if record is not None else ""
+        response_text = run_completion()
+        self._save({"model": model_name, "max_tokens": max_tokens, "prompt": prompt, "response": response_text},
+                   "gemini", model_name, max_tokens, prompt)
+        return response_text
+
+    def save_page(self, url, response):
+        self._save({
+            "url": url,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": dict(response.headers),
+            "body": base64.b64encode(response.content).decode("ascii"),
+        }, "pages", url)
+
+    def load_page(self, url):
+        return self._load("pages", url)
+
+    def mount(self, session, max_workers=10):
+        """
+        Route the session's webpage downloads through the store.
+        """
+        if self.replaying:
+            adapter = ReplayAdapter(self)
+        else:
+            adapter = RecordingAdapter(self, pool_connections=max_workers, pool_maxsize=max_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Regular http adapter that also saves every response (each redirect hop included).
+    304 Not Modified answers have no page to replay and are not saved.
+    """
+
+    def __init__(self, store, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if response.status_code == 304:
+            return response
+        # Read the whole body, even for streamed requests, so the page can be replayed in full
+        response.content
+        self.store.save_page(request.url, response)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Serve recorded responses instead of downloading; pages never recorded fail like an
+    unreachable host.
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def send(self, request, **kwargs):
+        record = self.store.load_page(request.url)
+        if record is None:
+            raise requests.ConnectionError(f"No recorded page for {request.url}", request=request)
+
+        body = base64.b64decode(record["body"])
+        response = requests.Response()
+        response.status_code = record["status"]
+        response.reason = record.get("reason")
+        response.headers = CaseInsensitiveDict(record["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.raw = io.BytesIO(body)
+        response._content = body
+        response._content_consumed = True
+        return response
+
+    def close(self):
+        pass
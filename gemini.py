@@ -1,7 +1,12 @@
 import json
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from prediction_cache import PredictionCache
+from instrumentation import metrics
 
 relation_requirements = {
     "Schools_Attended": {
@@ -32,9 +37,10 @@ relation_requirements = {
 
 
 # Generate response to prompt
-def get_gemini_completion(prompt, model_name="gemini-2.0-flash", max_tokens=200, temperature=0.2, top_p=1, top_k=32):
-    # Initialize a generative model
-    model = genai.GenerativeModel(model_name)
+def get_gemini_completion(prompt, model_name="gemini-2.0-flash", max_tokens=200, temperature=0.2, top_p=1, top_k=32, model=None):
+    # Initialize a generative model (unless the caller keeps one around)
+    if model is None:
+        model = genai.GenerativeModel(model_name)
 
     # Configure the model with your desired parameters
     generation_config = genai.types.GenerationConfig(
@@ -50,10 +56,146 @@ def get_gemini_completion(prompt, model_name="gemini-2.0-flash", max_tokens=200,
     return response.text.strip() if response.text else "No response received"
 
 
-def extract_relations_gemini(gemini_api_key, target_relation, sentence, results, num_extracted_tuples, num_extracted_sentences):
-    genai.configure(api_key=gemini_api_key)
+class TokenBucket:
+    """
+    Thread-safe token bucket that refills per_minute tokens every minute.
+    acquire() blocks only the calling thread until enough tokens are available.
+    """
 
-    prompt_text = """
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0  # tokens per second
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class GeminiClient:
+    """
+    Long-lived Gemini client shared by the whole run.
+
+    The API key is configured and the GenerativeModel is built once. Up to max_in_flight
+    requests run at the same time in a thread pool, paced by token buckets sized to the
+    quota (requests/min and tokens/min) instead of a fixed sleep after every call.
+    A 429 (resource exhausted) answer halves the number of requests allowed in flight;
+    it grows back by one after every few successful calls.
+
+    With a FixtureStore, completions are recorded, or replayed without calling Gemini (and
+    without any quota pacing).
+    """
+
+    def __init__(self, gemini_api_key, model_name="gemini-2.0-flash", max_in_flight=4, requests_per_min=15, tokens_per_min=1000000, max_retries=5, fixtures=None):
+        self.model_name = model_name
+        self.fixtures = fixtures
+        self.model = None
+        if fixtures is None or not fixtures.replaying:
+            genai.configure(api_key=gemini_api_key)
+            self.model = genai.GenerativeModel(model_name)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(requests_per_min)
+        self.token_bucket = TokenBucket(tokens_per_min)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+        # Adaptive concurrency limit, shrunk on 429s
+        self._limit = max_in_flight
+        self._in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def _acquire_slot(self):
+        with self._cond:
+            while self._in_flight >= self._limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def _release_slot(self, throttled):
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self._limit = max(1, self._limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= 10 and self._limit < self.max_in_flight:
+                    self._limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def complete(self, prompt_text, max_tokens=200):
+        """
+        Call Gemini, retrying with exponential backoff. Returns "" if every retry failed.
+        """
+        if self.fixtures is not None and self.fixtures.replaying:
+            metrics.count("gemini_requests")
+            return self.fixtures.gemini(prompt_text, self.model_name, max_tokens, None)
+
+        # If we don't get a successful response, try again
+        retries = 0
+
+        # To avoid resource exhausted errors
+        initial_delay = 2  # Start with a 2 second delay
+        delay = initial_delay
+        max_delay = 30  # Cap the delay to 30 seconds
+
+        while True:
+            with metrics.stage("gemini_quota_wait"):
+                self.request_bucket.acquire()
+                self.token_bucket.acquire(estimate_tokens(prompt_text) + max_tokens)
+                self._acquire_slot()
+            throttled = False
+            try:
+                metrics.count("gemini_requests")
+                with metrics.stage("gemini_call"):
+                    if self.fixtures is not None:
+                        response_text = self.fixtures.gemini(prompt_text, self.model_name, max_tokens, lambda: get_gemini_completion(prompt_text, self.model_name, max_tokens=max_tokens, model=self.model))
+                    else:
+                        response_text = get_gemini_completion(prompt_text, self.model_name, max_tokens=max_tokens, model=self.model)
+                return response_text  # Request succeeded, exit the retry loop
+            except Exception as e:
+                throttled = isinstance(e, google_exceptions.ResourceExhausted)
+                if throttled:
+                    metrics.count("gemini_throttled")
+                if retries >= self.max_retries:
+                    #print("Max retries reached. Skipping this sentence.")
+                    metrics.count("gemini_failed")
+                    return ""
+            finally:
+                self._release_slot(throttled)
+
+            #print(f"Error encountered: {e}. Retrying after {delay} seconds...")
+            metrics.count("gemini_retries")
+            with metrics.stage("gemini_backoff"):
+                time.sleep(delay + random.uniform(0, 1))  # Add jitter
+            retries += 1
+            delay = min(delay * 2, max_delay)  # Exponential backoff with a max cap
+
+    def complete_many(self, prompts, max_tokens=200):
+        """
+        Send every prompt concurrently and return the responses in the same order as prompts.
+        """
+        futures = [self.executor.submit(self.complete, prompt_text, max_tokens) for prompt_text in prompts]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def build_prompt(target_relation, sentence):
+    return """
     Below is an example of relation extraction for the '{relation}' relationship:
     Example Output: {relation_output}
     Example Sentence: {relation_sentence}
@@ -72,42 +214,79 @@ def extract_relations_gemini(gemini_api_key, target_relation, sentence, results,
         sentence=sentence
     )
 
-    # If we don't get a successful response, try again
-    retries = 0
-    max_retries = 5
-
-    # To avoid resource exhausted errors
-    initial_delay = 2  # Start with a 2 second delay
-    delay = initial_delay
-    max_delay = 30  # Cap the delay to 30 seconds
-        
-    while True:
-        try:
-            response_text = get_gemini_completion(prompt_text)
-            break  # Request succeeded, exit the retry loop
-        except Exception as e:
-            if retries < max_retries:
-                #print(f"Error encountered: {e}. Retrying after {delay} seconds...")
-                time.sleep(delay + random.uniform(0, 1))  # Add jitter
-                retries += 1
-                delay = min(delay * 2, max_delay)  # Exponential backoff with a max cap
-            else:
-                #print("Max retries reached. Skipping this sentence.")
-                response_text = ""
-                break
 
-    # print("Sentence: ", sentence)
-    # print("Output: ", response_text)
+def extract_relations_gemini(client, target_relation, sentence, results, num_extracted_tuples, num_extracted_sentences, cache=None):
+    return extract_relations_gemini_many(client, target_relation, [sentence], results, num_extracted_tuples, num_extracted_sentences, cache)
+
+
+def extract_relations_gemini_many(client, target_relation, sentences, results, num_extracted_tuples, num_extracted_sentences, cache=None):
+    """
+    Send one prompt per sentence through the shared GeminiClient (concurrently) and parse the
+    answers in sentence order, so printed output and results don't depend on timing.
+    Sentences already answered in the PredictionCache are not sent again.
+    """
+    parsed = gemini_relations_many(client, target_relation, sentences, cache)
+    return add_all_parsed_relations(sentences, parsed, results, num_extracted_tuples, num_extracted_sentences)
+
+
+def gemini_relations_many(client, target_relation, sentences, cache=None):
+    """
+    The parsed relations Gemini answers for every sentence (None where the answer can't be
+    parsed), one prompt per sentence.
+    """
+    parsed = cached_relations(cache, client, target_relation, sentences)
+    missing = [i for i, parsed_relations in enumerate(parsed) if parsed_relations is None]
+
+    prompts = [build_prompt(target_relation, sentences[i]) for i in missing]
+    responses = client.complete_many(prompts)
+
+    for i, response_text in zip(missing, responses):
+        # print("Sentence: ", sentences[i])
+        # print("Output: ", response_text)
+        parsed[i] = parse_relations(response_text)
+    store_relations(cache, client, target_relation, sentences, parsed, missing)
+    return parsed
+
+
+# Key of a sentence's Gemini answer in the PredictionCache
+def gemini_cache_key(client, target_relation, sentence):
+    return PredictionCache.key("gemini", target_relation, client.model_name, [token.text for token in sentence])
+
+
+def cached_relations(cache, client, target_relation, sentences):
+    """
+    Return the cached parsed relations of every sentence (None for the ones not cached).
+    """
+    if cache is None:
+        return [None] * len(sentences)
+    return [cache.get(gemini_cache_key(client, target_relation, sentence)) for sentence in sentences]
 
-    num_extracted_tuples, num_extracted_sentences = parse_response_text(sentence, response_text, results, num_extracted_tuples, num_extracted_sentences, target_relation)
 
-    # Add a short pause between successful requests to reduce load
-    time.sleep(3)
+def store_relations(cache, client, target_relation, sentences, parsed, indices):
+    # Only answers that could be parsed are worth remembering
+    if cache is None:
+        return
+    cache.put_many([(gemini_cache_key(client, target_relation, sentences[i]), parsed[i]) for i in indices if parsed[i] is not None])
 
+
+def add_all_parsed_relations(sentences, parsed, results, num_extracted_tuples, num_extracted_sentences):
+    for sentence, parsed_relations in zip(sentences, parsed):
+        if parsed_relations is not None:
+            num_extracted_tuples, num_extracted_sentences = add_parsed_relations(sentence, parsed_relations, results, num_extracted_tuples, num_extracted_sentences)
     return num_extracted_tuples, num_extracted_sentences
 
 
 def parse_response_text(sentence, response_text, results, num_extracted_tuples, num_extracted_sentences, target_relation):
+    parsed_relations = parse_relations(response_text)
+    if parsed_relations is None:
+        return num_extracted_tuples, num_extracted_sentences
+    return add_parsed_relations(sentence, parsed_relations, results, num_extracted_tuples, num_extracted_sentences)
+
+
+def parse_relations(response_text):
+    """
+    Parse the list of lists Gemini answered for one sentence. Returns None if it can't be parsed.
+    """
     # Clean the response text in case Gemini doesn't return a list of lists in the right form
     last_index = response_text.rfind(']')
 
@@ -119,33 +298,162 @@ def parse_response_text(sentence, response_text, results, num_extracted_tuples,
 
     try:
         parsed_relations = json.loads(cleaned_text)
-            
-        # Verify parsed result is a list
-        if isinstance(parsed_relations, list):
-            if len(parsed_relations) != 0:
-                num_extracted_sentences += 1
-            
-            for relation in parsed_relations:
-                # Ensure the relation is a list with exactly three items
-                if isinstance(relation, list) and len(relation) == 3:
-                    num_extracted_tuples += 1
-
-                    print("\n\t\t=== Extracted Relation ===")
-                    print("\t\tSentence: ", sentence)
-                    print(f"\t\tSubject: {relation[0]} ; Object: {relation[2]} ;")
-
-                    if tuple(relation) not in results:
-                        results.add(tuple(relation))
-                        print("\t\tAdding to set of extracted relations\n")
-                    else:
-                        print("\t\tDuplicate. Ignoring this.\n")
-                
-        else:
-            print("Parsed output is not a list:", parsed_relations)
-            return num_extracted_tuples, num_extracted_sentences
     except json.JSONDecodeError as e:
         print("Error parsing JSON:", e)
         print("cleaned_text:", cleaned_text)
-        return num_extracted_tuples, num_extracted_sentences
-    
-    return num_extracted_tuples, num_extracted_sentences
\ No newline at end of file
+        return None
+
+    # Verify parsed result is a list
+    if not isinstance(parsed_relations, list):
+        print("Parsed output is not a list:", parsed_relations)
+        return None
+
+    return parsed_relations
+
+
+def add_parsed_relations(sentence, parsed_relations, results, num_extracted_tuples, num_extracted_sentences):
+    if len(parsed_relations) != 0:
+        num_extracted_sentences += 1
+
+    for relation in parsed_relations:
+        # Ensure the relation is a list with exactly three items
+        if isinstance(relation, list) and len(relation) == 3:
+            num_extracted_tuples = add_gemini_relation(sentence, relation, results, num_extracted_tuples)
+
+    return num_extracted_tuples, num_extracted_sentences
+
+
+# Add one parsed [subject, relation, object] list to the results set
+def add_gemini_relation(sentence, relation, results, num_extracted_tuples):
+    num_extracted_tuples += 1
+
+    print("\n\t\t=== Extracted Relation ===")
+    print("\t\tSentence: ", sentence)
+    print(f"\t\tSubject: {relation[0]} ; Object: {relation[2]} ;")
+
+    if tuple(relation) not in results:
+        results.add(tuple(relation))
+        print("\t\tAdding to set of extracted relations\n")
+    else:
+        print("\t\tDuplicate. Ignoring this.\n")
+
+    return num_extracted_tuples
+
+
+# Rough token count of a piece of text (Gemini averages about 4 characters per token)
+def estimate_tokens(text):
+    return len(str(text)) // 4 + 1
+
+
+def build_batch_prompt(target_relation, sentences):
+    numbered_sentences = "\n".join(f"{i}. {sentence}" for i, sentence in enumerate(sentences, start=1))
+    return """
+    Below is an example of relation extraction for the '{relation}' relationship:
+    Example Output: {relation_output}
+    Example Sentence: {relation_sentence}
+
+    Now, given the following numbered sentences, extract all instances of the '{relation}' relationship from each sentence.
+    Return your answer as a JSON object whose keys are the sentence numbers (as strings) and whose values are lists of lists,
+    where each inner array is formatted as ["{subj_type}", "{relation}", "{obj_type}"].
+    Include every sentence number; use an empty array [] for a sentence with no relation.
+    Do not include any additional text or markdown formatting.
+    Sentences:
+    {sentences}
+    """.format(
+        relation=target_relation,
+        relation_output=relation_requirements[target_relation]["output"],
+        relation_sentence=relation_requirements[target_relation]["sentence"],
+        subj_type=relation_requirements[target_relation]["subj"],
+        obj_type=relation_requirements[target_relation]["obj"],
+        sentences=numbered_sentences
+    )
+
+
+def pack_sentences(target_relation, sentences, token_budget):
+    """
+    Greedily split sentences into batches whose prompt stays within token_budget tokens.
+    A sentence that doesn't fit in an empty batch still gets a batch of its own.
+    Returns the batches as lists of positions in sentences.
+    """
+    overhead = estimate_tokens(build_batch_prompt(target_relation, []))
+    batches = []
+    batch, batch_tokens = [], overhead
+    for i, sentence in enumerate(sentences):
+        sentence_tokens = estimate_tokens(sentence) + 2  # the "N. " prefix and newline
+        if batch and batch_tokens + sentence_tokens > token_budget:
+            batches.append(batch)
+            batch, batch_tokens = [], overhead
+        batch.append(i)
+        batch_tokens += sentence_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def extract_relations_gemini_batched(client, target_relation, sentences, results, num_extracted_tuples, num_extracted_sentences, token_budget=2000, cache=None):
+    """
+    Same as calling extract_relations_gemini() on every sentence, but several sentences are
+    packed into one numbered prompt (bounded by token_budget) and Gemini answers for all of
+    them at once. Sentences whose answer can't be parsed are retried one at a time.
+    """
+    parsed = gemini_relations_batched(client, target_relation, sentences, token_budget, cache)
+    return add_all_parsed_relations(sentences, parsed, results, num_extracted_tuples, num_extracted_sentences)
+
+
+def gemini_relations_batched(client, target_relation, sentences, token_budget=2000, cache=None):
+    """
+    The parsed relations Gemini answers for every sentence, with batched prompts.
+    """
+    parsed = cached_relations(cache, client, target_relation, sentences)
+    missing = [i for i, parsed_relations in enumerate(parsed) if parsed_relations is None]
+
+    batches = [[missing[j] for j in batch] for batch in pack_sentences(target_relation, [sentences[i] for i in missing], token_budget)]
+    prompts = [build_batch_prompt(target_relation, [sentences[i] for i in batch]) for batch in batches]
+    # Leave room in the output for every sentence of the batch
+    max_tokens = min(200 * max(len(batch) for batch in batches), 8192) if batches else 200
+    responses = client.complete_many(prompts, max_tokens=max_tokens)
+
+    unparsed = []
+    for batch, response_text in zip(batches, responses):
+        batch_parsed = parse_batch_response_text([sentences[i] for i in batch], response_text)
+        for i, parsed_relations in zip(batch, batch_parsed):
+            parsed[i] = parsed_relations
+            if parsed_relations is None:
+                unparsed.append(i)
+
+    # Retry the sentences whose answer couldn't be mapped back one by one
+    if unparsed:
+        print(f"\t\tCould not parse the batched answer for {len(unparsed)} of {len(missing)} sentences. Retrying them one by one.")
+        responses = client.complete_many([build_prompt(target_relation, sentences[i]) for i in unparsed])
+        for i, response_text in zip(unparsed, responses):
+            parsed[i] = parse_relations(response_text)
+    store_relations(cache, client, target_relation, sentences, parsed, missing)
+    return parsed
+
+
+def parse_batch_response_text(batch, response_text):
+    """
+    Map the JSON object answered for a numbered batch prompt back to its sentences.
+    Returns one parsed list of relations per sentence, or None for the sentences that could
+    not be parsed (all of them if the response isn't a JSON object).
+    """
+    unparsed = [None] * len(batch)
+
+    # Strip anything Gemini put around the JSON object (e.g. markdown fences)
+    first_index = response_text.find('{')
+    last_index = response_text.rfind('}')
+    if first_index == -1 or last_index < first_index:
+        return unparsed
+
+    try:
+        parsed = json.loads(response_text[first_index:last_index+1])
+    except json.JSONDecodeError:
+        return unparsed
+    if not isinstance(parsed, dict):
+        return unparsed
+
+    parsed_batch = []
+    for i in range(1, len(batch) + 1):
+        parsed_relations = parsed.get(str(i))
+        parsed_batch.append(parsed_relations if isinstance(parsed_relations, list) else None)
+    return parsed_batch
@@ -0,0 +1,186 @@
+import contextlib
+import cProfile
+import json
+import pstats
+import threading
+import time
+from collections import defaultdict
+from atomic_file import atomic_write
+
+# Shared no-op timer handed out while instrumentation is disabled
+_disabled_stage = contextlib.nullcontext()
+
+
+class Metrics:
+    """
+    Process-wide stage timers and event counters.
+
+    Stages (fetch, html_parse, spacy, candidate_pairs, spanbert, gemini_call, ...) add up
+    seconds and calls; counters count events (pages, sentences, candidate pairs, retries, ...).
+    While disabled, stage() returns a shared no-op context manager and count() returns at
+    once, so the instrumented code pays one attribute check per call.
+
+    enable() and disable() are counted, so metrics stay on until every run that turned them
+    on is done. The numbers are shared by the whole process, which is why concurrent runs
+    (batch.py) can't have their own --metrics report.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+        self._users = 0
+
+    def enable(self):
+        with self._lock:
+            self._users += 1
+            self.enabled = True
+
+    def disable(self):
+        with self._lock:
+            self._users = max(self._users - 1, 0)
+            self.enabled = self._users > 0
+
+    def stage(self, name):
+        """
+        Time a block: `with metrics.stage("spacy"): ...`
+        """
+        if not self.enabled:
+            return _disabled_stage
+        return self._timed(name)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.seconds[name] += seconds
+            self.calls[name] += calls
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += n
+
+    def merge(self, diff):
+        """
+        Add what happened elsewhere (a diff() of snapshots taken in a worker process).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            for name, seconds in diff["seconds"].items():
+                self.seconds[name] += seconds
+            for name, calls in diff["calls"].items():
+                self.calls[name] += calls
+            for name, n in diff["counters"].items():
+                self.counters[name] += n
+
+    def snapshot(self):
+        with self._lock:
+            return {"seconds": dict(self.seconds), "calls": dict(self.calls), "counters": dict(self.counters)}
+
+    @staticmethod
+    def diff(after, before):
+        """
+        What happened between two snapshots.
+        """
+        return {
+            section: {name: value - before[section].get(name, 0) for name, value in after[section].items()
+                      if value != before[section].get(name, 0)}
+            for section in ("seconds", "calls", "counters")
+        }
+
+
+metrics = Metrics()
+
+
+class RunReport:
+    """
+    Per-iteration and per-run metrics of one ISE run, rewritten to path after every
+    iteration as JSON or as Prometheus text exposition format.
+    """
+
+    def __init__(self, path, fmt="json"):
+        self.path = path
+        self.format = fmt
+        self.iterations = []
+        self.started_at = time.perf_counter()
+        self._run_start = metrics.snapshot()
+        self._iteration_start = None
+
+    def start_iteration(self):
+        self._iteration_start = metrics.snapshot()
+        self._iteration_started_at = time.perf_counter()
+
+    def end_iteration(self, number, query, tuples):
+        iteration = Metrics.diff(metrics.snapshot(), self._iteration_start)
+        iteration.update({"iteration": number, "query": query, "tuples": tuples,
+                          "wall_s": time.perf_counter() - self._iteration_started_at})
+        self.iterations.append(iteration)
+
+    def write(self, tuples, counters=None):
+        """
+        Write the report so far. counters adds run-level counts kept elsewhere (ex. cache hits).
+        """
+        run = Metrics.diff(metrics.snapshot(), self._run_start)
+        run["counters"].update(counters or {})
+        run.update({"tuples": tuples, "wall_s": time.perf_counter() - self.started_at})
+
+        if self.format == "prometheus":
+            data = self.prometheus(run)
+        else:
+            data = json.dumps({"run": run, "iterations": self.iterations}, indent=2)
+
+        with atomic_write(self.path) as f:
+            f.write(data)
+
+    def prometheus(self, run):
+        families = [
+            ("ise_stage_seconds_total", "Seconds spent in each pipeline stage.", "seconds", "stage", "{:.6f}"),
+            ("ise_stage_calls_total", "Number of times each pipeline stage ran.", "calls", "stage", "{}"),
+            ("ise_events_total", "Pipeline event counters.", "counters", "counter", "{}"),
+        ]
+        reports = [("", run)] + [(f',iteration="{it["iteration"]}"', it) for it in self.iterations]
+        lines = []
+        # Every sample of a metric follows its HELP/TYPE lines
+        for metric, help_text, section, label, value_format in families:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for labels, report in reports:
+                for name, value in sorted(report[section].items()):
+                    lines.append(f'{metric}{{{label}="{name}"{labels}}} {value_format.format(value)}')
+        lines.append(f"ise_run_wall_seconds {run['wall_s']:.6f}")
+        lines.append(f"ise_run_tuples {run['tuples']}")
+        return "\n".join(lines) + "\n"
+
+
+def start_profile():
+    """
+    Start cProfile (ex. around a single iteration, see --profile-iteration). Only the calling
+    thread is profiled; work in the fetch and Gemini thread pools shows up as waits.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler, path, top=25):
+    """
+    Stop the profiler, save its stats to path (for pstats / snakeviz) and print the top
+    functions by cumulative time.
+    """
+    profiler.disable()
+    profiler.dump_stats(path)
+    print(f"Profile saved to {path}")
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
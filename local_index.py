@@ -0,0 +1,335 @@
+"""
+Local BM25 search index over a corpus of pages kept on disk (see --search-backend local).
+
+Usage:
+    python3 local_index.py build <index dir> <corpus> [<corpus> ...] [--segment-docs N] [--rebuild]
+    python3 local_index.py search <index dir> "query" [-n N]
+
+A corpus is a JSONL file of {"url": ..., "text": ...} (or "html") records, or a directory of
+.jsonl, .html/.htm and plain text files.
+"""
+import argparse
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+from array import array
+from collections import Counter
+from atomic_file import atomic_write
+from dedup import stable_hash
+from web_fetch import html_to_text
+
+word_re = re.compile(r"\w+")
+
+# BM25 parameters
+k1 = 1.2
+b = 0.75
+
+
+def tokenize(text):
+    return word_re.findall(text.lower())
+
+
+def fingerprint(text):
+    return format(stable_hash(text), "016x")
+
+
+def corpus_documents(path):
+    """
+    Yield (url, text) for every document of a corpus: a JSONL file, or a directory of .jsonl,
+    .html/.htm and plain text files (walked in a fixed order). Files get their file:// url.
+    Html is cleaned like a downloaded page, and all whitespace runs become single spaces.
+    """
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(files):
+                if not name.startswith("."):
+                    yield from corpus_documents(os.path.join(root, name))
+        return
+
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                url = record.get("url") or f"{path}#{line_number}"
+                if "text" in record:
+                    yield url, " ".join(record["text"].split())
+                elif "html" in record:
+                    yield url, html_document_text(record["html"])
+        return
+
+    with open(path, encoding="utf-8", errors="replace") as f:
+        content = f.read()
+    url = "file://" + os.path.abspath(path)
+    if path.endswith((".html", ".htm")):
+        yield url, html_document_text(content)
+    else:
+        yield url, " ".join(content.split())
+
+
+def html_document_text(html):
+    # Keep the whole page: the --page-max-chars cap is applied when a run reads the text
+    return html_to_text(html, max_length=len(html))
+
+
+def write_segment(path, documents):
+    """
+    Write one index segment for documents ([(url, text), ...]) to the directory path:
+        terms.json     {term: [first posting, number of postings]}
+        postings.bin   (document, term frequency) pairs as native uint32, grouped by term
+        docs.json      [[url, length in tokens, text offset, text bytes], ...]
+        texts.bin      the utf-8 texts of the documents, back to back
+    Documents are numbered from 0 within the segment.
+    """
+    postings = {}  # term -> [(document, term frequency), ...]
+    docs = []
+    os.makedirs(path)
+    with open(os.path.join(path, "texts.bin"), "wb") as texts:
+        offset = 0
+        for number, (url, text) in enumerate(documents):
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((number, tf))
+            data = text.encode("utf-8")
+            texts.write(data)
+            docs.append([url, sum(counts.values()), offset, len(data)])
+            offset += len(data)
+
+    terms = {}
+    flat = array("I")
+    for term in sorted(postings):
+        terms[term] = [len(flat) // 2, len(postings[term])]
+        for number, tf in postings[term]:
+            flat.extend((number, tf))
+    with open(os.path.join(path, "postings.bin"), "wb") as f:
+        flat.tofile(f)
+    with open(os.path.join(path, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f)
+    with open(os.path.join(path, "docs.json"), "w", encoding="utf-8") as f:
+        json.dump(docs, f)
+
+
+def load_manifest(index_dir):
+    path = os.path.join(index_dir, "manifest.json")
+    if not os.path.exists(path):
+        return {"segments": [], "docs": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(index_dir, manifest):
+    # Written atomically, so an interrupted build keeps the last manifest
+    with atomic_write(os.path.join(index_dir, "manifest.json")) as f:
+        json.dump(manifest, f)
+
+
+def build_index(index_dir, corpora, segment_docs=10000, rebuild=False):
+    """
+    Add the documents of corpora to the index in index_dir, creating it if needed.
+
+    The build is incremental: documents whose url is already indexed with the same text are
+    skipped, and new or changed ones are written to new segments of at most segment_docs
+    documents. A url repeated in corpora keeps its first document. The manifest ({"segments": [...], "docs": {url: [segment, document,
+    fingerprint]}}) points every url at its latest copy, so older copies are ignored by
+    searches. The manifest is saved after every segment. rebuild starts from an empty index,
+    which also drops old copies and documents that left the corpus.
+    """
+    if rebuild and os.path.isdir(index_dir):
+        shutil.rmtree(index_dir)
+    os.makedirs(index_dir, exist_ok=True)
+    manifest = load_manifest(index_dir)
+    added = unchanged = 0
+
+    def flush(pending):
+        name = f"segment-{len(manifest['segments']):05d}"
+        path = os.path.join(index_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)  # Left over from an interrupted build, never made it into the manifest
+        write_segment(path, [(url, text) for url, text, _ in pending])
+        for number, (url, _, digest) in enumerate(pending):
+            manifest["docs"][url] = [len(manifest["segments"]), number, digest]
+        manifest["segments"].append(name)
+        save_manifest(index_dir, manifest)
+        print(f"Wrote {name} with {len(pending)} documents")
+
+    pending = []
+    seen_urls = set()  # A url repeated in the corpora keeps its first document
+    for corpus in corpora:
+        for url, text in corpus_documents(corpus):
+            if url in seen_urls:
+                continue
+            seen_urls.add(url)
+            digest = fingerprint(text)
+            indexed = manifest["docs"].get(url)
+            if indexed is not None and indexed[2] == digest:
+                unchanged += 1
+                continue
+            pending.append((url, text, digest))
+            added += 1
+            if len(pending) >= segment_docs:
+                flush(pending)
+                pending = []
+    if pending:
+        flush(pending)
+    print(f"Indexed {added} new or changed documents ({unchanged} unchanged) in {index_dir}")
+
+
+def map_file(path):
+    """
+    Read-only memory map of the file at path, or None if it is empty (mmap can't map 0 bytes).
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class IndexSegment:
+    """
+    One segment of a LocalIndex. The postings and texts are memory-mapped, so opening a
+    segment only reads its term dictionary and document table; the operating system pages in
+    the postings of the query terms as they are searched.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "terms.json"), encoding="utf-8") as f:
+            self.terms = json.load(f)
+        with open(os.path.join(path, "docs.json"), encoding="utf-8") as f:
+            self.docs = json.load(f)
+        self._postings_map = map_file(os.path.join(path, "postings.bin"))
+        self.postings = memoryview(self._postings_map).cast("I") if self._postings_map is not None else memoryview(array("I"))
+        self._texts_map = map_file(os.path.join(path, "texts.bin"))
+        self.live = bytearray(len(self.docs))  # 1 for documents that are the latest copy of their url
+
+    def term_postings(self, term):
+        """
+        The flat (document, term frequency) pairs of term, or None.
+        """
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        start, count = entry
+        return self.postings[2 * start:2 * (start + count)]
+
+    def text(self, number):
+        _, _, offset, size = self.docs[number]
+        if self._texts_map is None:
+            return ""
+        return self._texts_map[offset:offset + size].decode("utf-8")
+
+    def close(self):
+        self.postings.release()
+        for mapped in (self._postings_map, self._texts_map):
+            if mapped is not None:
+                mapped.close()
+
+
+class LocalIndex:
+    """
+    Searchable view of an index directory written by build_index(). Documents are ranked
+    with BM25 over every segment; copies of a url that were replaced by a later build are
+    skipped. Document frequencies count those old copies too, until the next --rebuild.
+    """
+
+    def __init__(self, index_dir):
+        manifest = load_manifest(index_dir)
+        if not manifest["segments"]:
+            raise ValueError(f"No index in {index_dir}. Build one with: python3 local_index.py build {index_dir} <corpus>")
+        self.segments = [IndexSegment(os.path.join(index_dir, name)) for name in manifest["segments"]]
+        self.locations = {}  # url -> (segment, document)
+        total_length = 0
+        for url, (segment, number, _) in manifest["docs"].items():
+            self.segments[segment].live[number] = 1
+            self.locations[url] = (segment, number)
+            total_length += self.segments[segment].docs[number][1]
+        self.num_docs = len(self.locations)
+        self.avgdl = total_length / max(self.num_docs, 1)
+
+    def search(self, query, num_results=10):
+        """
+        The top num_results documents for query as [(url, score), ...], best first.
+        """
+        terms = set(tokenize(query))
+        scores = {}  # (segment, document) -> score
+        for term in terms:
+            per_segment = [(segment, segment.term_postings(term)) for segment in self.segments]
+            df = sum(len(postings) // 2 for _, postings in per_segment if postings is not None)
+            if df == 0:
+                continue
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            for s, (segment, postings) in enumerate(per_segment):
+                if postings is None:
+                    continue
+                live = segment.live
+                docs = segment.docs
+                for i in range(0, len(postings), 2):
+                    number, tf = postings[i], postings[i + 1]
+                    if not live[number]:
+                        continue
+                    norm = k1 * (1 - b + b * docs[number][1] / self.avgdl)
+                    scores[s, number] = scores.get((s, number), 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(num_results, scores.items(), key=lambda item: item[1])
+        return [(self.segments[s].docs[number][0], score) for (s, number), score in top]
+
+    def text(self, url):
+        """
+        The stored text of url, or None if it is not in the index.
+        """
+        location = self.locations.get(url)
+        if location is None:
+            return None
+        segment, number = location
+        return self.segments[segment].text(number)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a local BM25 search index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Add the documents of one or more corpora to an index (incremental)")
+    build.add_argument("index_dir", type=str, help="Index directory (created if needed)")
+    build.add_argument("corpora", nargs="+", help="JSONL files or directories of .jsonl, .html and text files")
+    build.add_argument(
+        "--segment-docs",
+        dest="segment_docs",
+        type=int,
+        default=10000,
+        help="Maximum number of documents per index segment (default: 10000)"
+    )
+    build.add_argument(
+        "--rebuild",
+        dest="rebuild",
+        action="store_true",
+        help="Delete the index and build it again from the corpora"
+    )
+
+    search = commands.add_parser("search", help="Print the top results of a query")
+    search.add_argument("index_dir", type=str, help="Index directory")
+    search.add_argument("query", type=str, help="Query string")
+    search.add_argument("-n", dest="num_results", type=int, default=10, help="Number of results (default: 10)")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        if args.segment_docs <= 0:
+            parser.error("--segment-docs must be greater than 0")
+        build_index(args.index_dir, args.corpora, args.segment_docs, args.rebuild)
+    else:
+        index = LocalIndex(args.index_dir)
+        for rank, (url, score) in enumerate(index.search(args.query, args.num_results), 1):
+            print(f"{rank:3d}. {score:7.3f}  {url}")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,20 @@
 import argparse
-import re
-from bs4 import BeautifulSoup
-import requests
-import spacy
-from spacy_help_functions import get_entities, create_entity_pairs
-from gemini import extract_relations_gemini
-from spanbert_process import extract_relations_spanbert
-from googleapiclient.discovery import build
-from spanbert import SpanBERT
+import time
+from collections import namedtuple
+from spacy_help_functions import get_entities, create_candidate_pairs, matches_requirement
+from gemini import extract_relations_gemini_many, extract_relations_gemini_batched, estimate_tokens
+from spanbert_process import predict_with_cache, route_spanbert_predictions, SpanBERTBatcher
+from spanbert_backends import spanbert_backends, spanbert_model_name
+from web_fetch import fetch_pages
+from result_store import SpanBERTResults, GeminiResults, MultiRelationResults
+from models import Models
+from resources import ISEResources, LockedPredictor, SearchPrefetcher
+from checkpoint import save_checkpoint, load_checkpoint
+from instrumentation import metrics, RunReport, start_profile, stop_profile
+from dedup import PageDeduplicator, SentenceDeduplicator
+from relevance import LexicalScorer, SpanBERTScorer, RelevanceFilter
+from chunking import PageBudget, budgeted, chunked_sentences, estimate_sentences
+from search_backends import search_backends, GoogleSearch
 
 # Map relation numbers to names for clarity
 relation_map = {
@@ -59,7 +66,39 @@ def check_positive_int(value):
     return i
 
 
-def validate_args():
+def check_non_negative_int(value):
+    """
+    Check that the user inputted argument is an integer greater than or equal to 0,
+    for options where 0 means "off".
+    """
+    try:
+        i = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Value must be an integer.")
+    if i < 0:
+        raise argparse.ArgumentTypeError("Value must be greater than or equal to 0.")
+    return i
+
+
+def check_relations(value):
+    """
+    Check that the user inputted list of relations is comma-separated relation numbers
+    between 1 and 4, ex. "1,2,3,4".
+    """
+    relations = []
+    for part in value.split(","):
+        try:
+            r = int(part)
+        except ValueError:
+            raise argparse.ArgumentTypeError("Relations must be comma-separated integers.")
+        if r not in relation_map:
+            raise argparse.ArgumentTypeError("Relations must be between 1 and 4.")
+        if r not in relations:
+            relations.append(r)
+    return relations
+
+
+def validate_args(argv=None):
     parser = argparse.ArgumentParser()
 
     group = parser.add_mutually_exclusive_group(required=True)
@@ -92,72 +131,442 @@ def validate_args():
     parser.add_argument("q", type=str, help='Seed query as a quoted string, ex. "bill gates microsoft"')
     parser.add_argument("k", type=check_positive_int, help="Number of tuples to request (must be > 0)")
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--fetch-workers",
+        dest="fetch_workers",
+        type=check_positive_int,
+        default=10,
+        help="Number of webpages to download in parallel (default: 10)"
+    )
+    parser.add_argument(
+        "--page-cache",
+        dest="page_cache",
+        type=str,
+        default=None,
+        help="Path of a SQLite file used to cache downloaded webpages across runs (disabled by default)"
+    )
+    parser.add_argument(
+        "--page-cache-ttl",
+        dest="page_cache_ttl",
+        type=check_positive_int,
+        default=24 * 60 * 60,
+        help="Seconds a cached webpage is used before it is revalidated with the server (default: 86400)"
+    )
+    parser.add_argument(
+        "--page-cache-max-mb",
+        dest="page_cache_max_mb",
+        type=check_positive_int,
+        default=500,
+        help="Maximum size of the webpage cache in megabytes; least recently used pages are evicted first (default: 500)"
+    )
+    parser.add_argument(
+        "--stream-html",
+        dest="stream_html",
+        action="store_true",
+        help="Parse webpages incrementally while downloading and stop reading once --page-max-chars characters of text exist"
+    )
+    parser.add_argument(
+        "--page-max-chars",
+        dest="page_max_chars",
+        type=check_positive_int,
+        default=None,
+        help="Characters of text kept per webpage (default: 10000, or 1000000 with --page-chunk-chars)"
+    )
+    parser.add_argument(
+        "--page-chunk-chars",
+        dest="page_chunk_chars",
+        type=check_positive_int,
+        default=None,
+        help="Annotate and extract long webpages one sentence-aligned chunk of at most this many characters at a time (disabled by default)"
+    )
+    parser.add_argument(
+        "--page-sentence-budget",
+        dest="page_sentence_budget",
+        type=check_positive_int,
+        default=None,
+        help="Stop processing a webpage after this many sentences (default: no limit)"
+    )
+    parser.add_argument(
+        "--page-time-budget",
+        dest="page_time_budget",
+        type=float,
+        default=None,
+        help="Stop processing a webpage after this many seconds spent on its sentences (default: no limit)"
+    )
+    parser.add_argument(
+        "--spacy-fast",
+        dest="spacy_fast",
+        action="store_true",
+        help="Disable the spaCy components the extractors don't use (tagger, attribute_ruler, lemmatizer)"
+    )
+    parser.add_argument(
+        "--spacy-batch-size",
+        dest="spacy_batch_size",
+        type=check_positive_int,
+        default=10,
+        help="Number of webpages annotated together in one nlp.pipe batch (default: 10)"
+    )
+    parser.add_argument(
+        "--spacy-n-process",
+        dest="spacy_n_process",
+        type=check_positive_int,
+        default=1,
+        help="Number of processes nlp.pipe uses to annotate webpages (default: 1)"
+    )
+    parser.add_argument(
+        "--spanbert-batch",
+        dest="spanbert_batch",
+        choices=["sentence", "page", "iteration"],
+        default="sentence",
+        help="Collect SpanBERT candidate pairs per sentence, per page or per iteration before predicting (default: sentence)"
+    )
+    parser.add_argument(
+        "--spanbert-batch-size",
+        dest="spanbert_batch_size",
+        type=check_positive_int,
+        default=64,
+        help="Maximum number of candidate pairs in one SpanBERT forward pass when batching across sentences (default: 64)"
+    )
+    parser.add_argument(
+        "--spanbert-backend",
+        dest="spanbert_backend",
+        choices=spanbert_backends,
+        default="torch",
+        help="Run SpanBERT in full-precision PyTorch, with int8 dynamic quantization, or exported to onnxruntime (default: torch)"
+    )
+    parser.add_argument(
+        "--spanbert-threads",
+        dest="spanbert_threads",
+        type=check_positive_int,
+        default=None,
+        help="Intra-op threads of the SpanBERT backend (default: the runtime's own choice)"
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=0,
+        help="Annotate pages and run SpanBERT in this many worker processes, each loading spaCy and SpanBERT once (-spanbert only; default: 0, in-process)"
+    )
+    parser.add_argument(
+        "--gemini-batch-tokens",
+        dest="gemini_batch_tokens",
+        type=check_non_negative_int,
+        default=0,
+        help="Pack several sentences of a page into one Gemini prompt of at most this many tokens (default: 0, one prompt per sentence)"
+    )
+    parser.add_argument(
+        "--gemini-concurrency",
+        dest="gemini_concurrency",
+        type=check_positive_int,
+        default=4,
+        help="Maximum number of Gemini requests in flight at once (default: 4)"
+    )
+    parser.add_argument(
+        "--gemini-rpm",
+        dest="gemini_rpm",
+        type=check_positive_int,
+        default=15,
+        help="Gemini quota in requests per minute (default: 15)"
+    )
+    parser.add_argument(
+        "--gemini-tpm",
+        dest="gemini_tpm",
+        type=check_positive_int,
+        default=1000000,
+        help="Gemini quota in tokens per minute (default: 1000000)"
+    )
+    parser.add_argument(
+        "--prediction-cache",
+        dest="prediction_cache",
+        type=str,
+        default=None,
+        help="Path of a SQLite file used to remember SpanBERT/Gemini predictions across runs (disabled by default)"
+    )
+    parser.add_argument(
+        "--prediction-cache-lru",
+        dest="prediction_cache_lru",
+        type=check_positive_int,
+        default=10000,
+        help="Number of predictions kept in memory in front of the prediction cache file (default: 10000)"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        dest="checkpoint",
+        type=str,
+        default=None,
+        help="Path of a JSON file the ISE state is saved to after every webpage and every iteration (disabled by default)"
+    )
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        type=str,
+        default=None,
+        help="Continue the run saved in this checkpoint file; new checkpoints go to the same file unless --checkpoint is given"
+    )
+    parser.add_argument(
+        "--relations",
+        dest="relations",
+        type=check_relations,
+        default=None,
+        help="Extract several relations in one pass over the same pages, ex. 1,2,3,4 (replaces r)"
+    )
+    parser.add_argument(
+        "--gemini-prefilter",
+        dest="gemini_prefilter",
+        choices=["lexical", "spanbert"],
+        default=None,
+        help="Score candidate sentences with relation trigger words or with SpanBERT and only send those reaching --gemini-prefilter-threshold to Gemini (disabled by default)"
+    )
+    parser.add_argument(
+        "--gemini-prefilter-threshold",
+        dest="gemini_prefilter_threshold",
+        type=check_threshold,
+        default=0.5,
+        help="Minimum relevance score of a sentence sent to Gemini when --gemini-prefilter is on (default: 0.5)"
+    )
+    parser.add_argument(
+        "--dedup-pages",
+        dest="dedup_pages",
+        action="store_true",
+        help="Skip webpages whose text is a near-duplicate (SimHash) of a page already processed in this run"
+    )
+    parser.add_argument(
+        "--dedup-distance",
+        dest="dedup_distance",
+        type=int,
+        default=3,
+        help="Maximum number of differing SimHash bits (out of 64) for --dedup-pages to call two pages near-duplicates (default: 3)"
+    )
+    parser.add_argument(
+        "--dedup-sentences",
+        dest="dedup_sentences",
+        action="store_true",
+        help="Never send a sentence (same tokens and entities) to extraction twice in a run"
+    )
+    parser.add_argument(
+        "--stop-early",
+        dest="stop_early",
+        action="store_true",
+        help="Stop as soon as k tuples are extracted, skipping the remaining webpages of the iteration"
+    )
+    parser.add_argument(
+        "--prefetch-searches",
+        dest="prefetch_searches",
+        type=check_non_negative_int,
+        default=0,
+        help="Maximum number of speculative searches per iteration for the likely next query (default: 0, off)"
+    )
+
+    parser.add_argument(
+        "--metrics",
+        dest="metrics",
+        type=str,
+        default=None,
+        help="Time every pipeline stage and write a per-iteration and per-run report to this file (disabled by default)"
+    )
+    parser.add_argument(
+        "--metrics-format",
+        dest="metrics_format",
+        choices=["json", "prometheus"],
+        default="json",
+        help="Format of the --metrics report (default: json)"
+    )
+    parser.add_argument(
+        "--profile-iteration",
+        dest="profile_iteration",
+        type=check_non_negative_int,
+        default=None,
+        help="Run cProfile around this iteration (0 is the first one) and save the stats to --profile-output"
+    )
+    parser.add_argument(
+        "--profile-output",
+        dest="profile_output",
+        type=str,
+        default="iteration.prof",
+        help="File the --profile-iteration stats are saved to (default: iteration.prof)"
+    )
+    parser.add_argument(
+        "--search-backend",
+        dest="search_backend",
+        choices=search_backends,
+        default="google",
+        help="Where queries are searched: Google Custom Search, or a local BM25 index of pages on disk (default: google)"
+    )
+    parser.add_argument(
+        "--search-index",
+        dest="search_index",
+        type=str,
+        default=None,
+        help="Index directory of --search-backend local, built with local_index.py"
+    )
+    parser.add_argument(
+        "--num-results",
+        dest="num_results",
+        type=check_positive_int,
+        default=10,
+        help="Number of search results processed per iteration (default: 10; at most 100 with Google)"
+    )
+    fixture_mode = parser.add_mutually_exclusive_group()
+    fixture_mode.add_argument(
+        "--record",
+        dest="record",
+        type=str,
+        default=None,
+        help="Save every search result, webpage and Gemini completion of the run to this fixture directory"
+    )
+    fixture_mode.add_argument(
+        "--replay",
+        dest="replay",
+        type=str,
+        default=None,
+        help="Serve searches, webpages and Gemini completions from this fixture directory instead of the network"
+    )
+
+    args = parser.parse_args(argv)
+    if args.relations is None:
+        args.relations = [args.r]
+    if not 0 <= args.dedup_distance < 32:
+        parser.error("--dedup-distance must be between 0 and 31")
+    if args.page_max_chars is None:
+        args.page_max_chars = 1000000 if args.page_chunk_chars else 10000
+    if args.page_time_budget is not None and args.page_time_budget <= 0:
+        parser.error("--page-time-budget must be greater than 0")
+    if args.workers < 0:
+        parser.error("--workers must be 0 or more")
+    if args.workers and args.extraction_method != 'spanbert':
+        parser.error("--workers only applies to -spanbert runs")
+    # Pages are recorded as they come off the network, whole (see fixtures.RecordingAdapter)
+    if args.record is not None and args.page_cache is not None:
+        parser.error("--record can't be used with --page-cache: cached pages are never downloaded, so they would not be recorded")
+    if args.record is not None and args.stream_html:
+        parser.error("--record can't be used with --stream-html: pages are recorded whole (replays can use --stream-html)")
+    if args.search_backend == "local" and args.search_index is None:
+        parser.error("--search-backend local requires --search-index")
+    if args.search_backend == "google" and args.num_results > GoogleSearch.max_results:
+        parser.error(f"--num-results can be at most {GoogleSearch.max_results} with Google Custom Search")
     return args
 
 
-def extract_plain_text(url, max_length=10000):
-    """
-    Retrieve the webpage. Skip if there's an error. Extract plain text using BeautifulSoup.
-    Truncate text to max_length if necessary.
-    """
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    try:
-        response = requests.get(url, timeout=10, headers=headers)
-        response.raise_for_status()
-    except Exception as e:
-        # print(f"Skipping URL {url} due to retrieval error: {e}")
-        # print(e)
-        return None
+# (target_r, requirement, results) for every relation of the run, as used by route_spanbert_predictions()
+def spanbert_targets(results):
+    return [(internal_map[r], relation_requirements[relation_map[r]], store) for r, store in results.items()]
+
 
-    # Parse the HTML file
-    soup = BeautifulSoup(response.text, "html.parser")
+# Settings every extraction worker process is started with (see workers.py)
+def worker_initargs(args, models):
+    # One intra-op thread per worker unless asked otherwise, so N workers don't fight over the cores
+    return (models.spanbert_dir, args.spacy_fast, args.spanbert_backend, args.spanbert_threads or 1, args.spanbert_batch_size,
+            spanbert_model_name(args.spanbert_backend), entities_of_interest, args.prediction_cache, args.prediction_cache_lru,
+            args.page_chunk_chars, args.page_sentence_budget, args.page_time_budget)
 
-    # Remove common unwanted tags
-    for tag in soup.find_all(["script", "style", "header", "footer", "nav", "aside"]):
-        tag.decompose()
 
-    # Extract plain text from the HTML
-    raw_text = soup.get_text(separator=" ", strip=True)
+# Sentence and time budget of one webpage (see --page-sentence-budget, --page-time-budget)
+def page_budget(args):
+    return PageBudget(args.page_sentence_budget, args.page_time_budget)
+
+
+# Relevance filter of the Gemini candidate sentences (see --gemini-prefilter), or None
+def relevance_filter(args, spanbert, prediction_cache=None):
+    if args.extraction_method != 'gemini' or args.gemini_prefilter is None:
+        return None
+    if args.gemini_prefilter == 'spanbert':
+        scorer = SpanBERTScorer(spanbert, {relation_map[r]: internal_map[r] for r in relation_map}, relation_requirements,
+                                prediction_cache, spanbert_model_name(args.spanbert_backend))
+    else:
+        scorer = LexicalScorer()
+    return RelevanceFilter(scorer, args.gemini_prefilter_threshold)
 
-    # Removing redundant whitespace
-    raw_text = re.sub('\t', ' ', raw_text)
-    raw_text = re.sub('\n', ' ', raw_text)
-    raw_text = re.sub(' +', ' ', raw_text)
 
-    # Truncate text if it's longer than max_length characters
-    if len(raw_text) > max_length:
-        print(f"\tTrimming webpage content from {len(raw_text)} to 10000 characters")
-        raw_text = raw_text[:max_length]
+# Per-run state extract_relations() uses besides the page, built once by run_ise(); None for
+# what the run doesn't use (ex. gemini_client in a -spanbert run)
+ExtractionContext = namedtuple("ExtractionContext", ["batcher", "gemini_client", "prediction_cache", "seen_sentences", "relevance"],
+                               defaults=(None, None, None, None, None))
 
-    return raw_text
 
 # Extract relations based on doc and 1) check for right pair of entity types 2) extract 3) check for duplicates based on results
-# NOTE: expecting set() result type for gemini, expecting {} result type for spanBERT
-def extract_relations(args, results, doc, requirement, spanbert):
+# NOTE: results maps each relation number of the run to its results store,
+# expecting GeminiResults result type for gemini, expecting SpanBERTResults result type for spanBERT
+# NOTE: candidate pairs are built once per sentence for all relations, then each relation only sees
+# the pairs whose entity types match its requirement
+# NOTE: with a SpanBERTBatcher, candidate pairs are only queued here; they are predicted at the end
+# of the page (--spanbert-batch page) or by the caller at the end of the iteration (--spanbert-batch iteration)
+# sentences can also be a generator (--page-chunk-chars, page budgets); total is then its expected length for progress reports
+# NOTE: everything after sentences is keyword-only; context is an ExtractionContext and budget the page's PageBudget
+def extract_relations(args, results, doc, spanbert, sentences=None, *, context=None, url=None, total=None, budget=None):
+    batcher, gemini_client, prediction_cache, seen_sentences, relevance = context or ExtractionContext()
     num_processed = 0
     num_extraced_sentences = 0
     num_extracted_tuples = 0
-    curr_len = len(results)
-    TOTAL = len(list(doc.sents))
+    requirements = {r: relation_requirements[relation_map[r]] for r in results}
+    curr_len = {r: len(store) for r, store in results.items()}
+    if sentences is None:
+        sentences = list(doc.sents)
+    TOTAL = len(sentences) if total is None else total
+    gemini_sentences = {r: [] for r in results}  # candidate sentences of this chunk waiting to be sent to Gemini
+    waiting = []  # sentences of this chunk with candidates waiting for Gemini or the page's SpanBERT batch
+    current_doc = None
+    num_duplicates = 0
+    num_filtered = 0  # (sentence, relation) candidates the relevance filter kept away from Gemini
+    num_dropped = 0  # candidate sentences left out because the page's time budget ran out
+    # With --page-time-budget, queued work is also sent in groups as it grows, with a budget check
+    # before each one: a SpanBERT batch of pairs, or one round of concurrent Gemini prompts
+    group_size = None
+    if budget is not None and budget.max_seconds is not None:
+        group_size = args.spanbert_batch_size if args.extraction_method == 'spanbert' else args.gemini_concurrency
+    queued = 0  # pairs (SpanBERT) or prompts (Gemini) of the waiting sentences
 
-    for sentence in doc.sents:
+    # Send what the waiting sentences queued: at the end of every chunk (the whole page without
+    # --page-chunk-chars), so a waiting sentence never keeps an earlier chunk's Doc alive, and
+    # whenever a group is full under the time budget.
+    def flush_waiting():
+        nonlocal num_extracted_tuples, num_extraced_sentences, num_dropped, queued
+        queued = 0
+        if not waiting:
+            return
+        # The time budget also covers these calls, the costly part of a page
+        if budget is not None and budget.out_of_time():
+            num_dropped += len(waiting)
+            if seen_sentences is not None:
+                for sentence in waiting:
+                    seen_sentences.forget(sentence)
+            if batcher is not None and args.spanbert_batch == 'page':
+                num_extraced_sentences -= len(batcher.pending)
+                batcher.pending = []
+        else:
+            if batcher is not None and args.spanbert_batch == 'page':
+                print(f"\tRunning SpanBERT on {sum(len(p[0]) for p in batcher.pending)} candidate pairs from this website ...")
+                num_extracted_tuples = batcher.flush(spanbert_targets(results), num_extracted_tuples, args.t)
 
-        # Create entity pairs
-        candidate_pairs = []
-        sentence_entity_pairs = create_entity_pairs(sentence, entities_of_interest)
+            # Gemini prompts ask for one relation, so each relation gets its own prompts
+            for r, sentences_r in gemini_sentences.items():
+                if sentences_r and args.gemini_batch_tokens > 0:
+                    print(f"\tSending {len(sentences_r)} candidate sentences to Gemini in batched prompts ...")
+                    num_extracted_tuples, num_extraced_sentences = extract_relations_gemini_batched(gemini_client, relation_map[r], sentences_r, results[r], num_extracted_tuples, num_extraced_sentences, args.gemini_batch_tokens, prediction_cache)
+                elif sentences_r:
+                    print(f"\tSending {len(sentences_r)} candidate sentences to Gemini ...")
+                    num_extracted_tuples, num_extraced_sentences = extract_relations_gemini_many(gemini_client, relation_map[r], sentences_r, results[r], num_extracted_tuples, num_extraced_sentences, prediction_cache)
+        waiting.clear()
+        for r in gemini_sentences:
+            gemini_sentences[r] = []
 
-        for ep in sentence_entity_pairs:
-            # Get possible ordering of pairs
-            pair1 = {"tokens": ep[0], "subj": ep[1], "obj": ep[2]}  # e1=Subject, e2=Object
-            pair2 = {"tokens": ep[0], "subj": ep[2], "obj": ep[1]}  # e1=Object, e2=Subject
+    for sentence in sentences:
+        if sentence.doc is not current_doc:
+            flush_waiting()
+            current_doc = sentence.doc
+
+        # The same sentence gives the same candidate pairs, which were already extracted (see --dedup-sentences)
+        if seen_sentences is not None and seen_sentences.seen(sentence):
+            num_duplicates += 1
+            num_processed += 1
+            continue
+
+        # Create entity pairs, keeping only subject-object orderings of the right type for the target relations
+        with metrics.stage("candidate_pairs"):
+            candidate_pairs = create_candidate_pairs(sentence, entities_of_interest, list(requirements.values()))
+        metrics.count("sentences")
+        metrics.count("candidate_pairs", len(candidate_pairs))
 
-            # Keep subject-object pairs of the right type for the target relation
-            if pair1["subj"][1] == requirement["subj"] and pair1["obj"][1] in requirement["obj"]:
-                candidate_pairs.append(pair1)
-            if pair2["subj"][1] == requirement["subj"] and pair2["obj"][1] in requirement["obj"]:
-                candidate_pairs.append(pair2)
-        
         if len(candidate_pairs) > 0:
             # TODO: Each method returns
             # 1) updated results (in a list or dictionary)
@@ -165,53 +574,223 @@ def extract_relations(args, results, doc, requirement, spanbert):
             if args.extraction_method == 'spanbert':
                 num_extraced_sentences += 1
                 input_tokens = [token.text for token in sentence]
-                results, num_extracted_tuples = extract_relations_spanbert(spanbert, candidate_pairs, input_tokens, results, num_extracted_tuples, args.t, internal_map[args.r])
-                # relation_preds = spanbert.predict(candidate_pairs)
-                # results, total_extracted = [], 0
+                if batcher is not None:
+                    batcher.add(candidate_pairs, input_tokens, (url, num_processed))
+                    if args.spanbert_batch == 'page':
+                        waiting.append(sentence)
+                        queued += len(candidate_pairs)
+                else:
+                    # One prediction per pair serves every relation: SpanBERT returns the argmax label
+                    relation_preds = predict_with_cache(spanbert, candidate_pairs, prediction_cache, spanbert_model_name(args.spanbert_backend))
+                    num_extracted_tuples = route_spanbert_predictions(candidate_pairs, relation_preds, input_tokens, spanbert_targets(results), num_extracted_tuples, args.t)
             else:
-                num_extracted_tuples, num_extraced_sentences = extract_relations_gemini(args.google_gemini_api_key, relation_map[args.r], sentence, results, num_extracted_tuples, num_extraced_sentences) 
+                wanted = [r for r, requirement in requirements.items() if any(matches_requirement(pair, requirement) for pair in candidate_pairs)]
+                # Only sentences that likely express the relation are worth a Gemini call (see --gemini-prefilter)
+                if relevance is not None and wanted:
+                    kept = relevance.keep(sentence, candidate_pairs, [relation_map[r] for r in wanted])
+                    num_filtered += len(wanted) - len(kept)
+                    wanted = [r for r in wanted if relation_map[r] in kept]
+                for r in wanted:
+                    gemini_sentences[r].append(sentence)
+                if wanted:
+                    waiting.append(sentence)
+                    # A batched prompt holds about gemini_batch_tokens tokens of sentences
+                    if args.gemini_batch_tokens > 0:
+                        queued += len(wanted) * (estimate_tokens(sentence) + 2) / args.gemini_batch_tokens
+                    else:
+                        queued += len(wanted)
+            if group_size is not None and queued >= group_size:
+                flush_waiting()
         
         num_processed += 1
         if (num_processed % 5 == 0):
             print(f"\tProcessed {num_processed} / {TOTAL} sentences")
 
+    flush_waiting()
+    if num_dropped:
+        print(f"\tThe time budget of this page ran out before {num_dropped} candidate sentences were sent to {'SpanBERT' if args.extraction_method == 'spanbert' else 'Gemini'}")
+        metrics.count("budget_dropped_sentences", num_dropped)
+
+    # A streamed page only knows its number of sentences at the end
+    print_page_summary(results, curr_len, num_extraced_sentences, TOTAL if total is None else num_processed, num_extracted_tuples, num_duplicates, num_filtered)
+    return results
+
+
+def print_page_summary(results, curr_len, num_extraced_sentences, total, num_extracted_tuples, num_duplicates=0, num_filtered=0):
+    num_new = sum(len(store) - curr_len[r] for r, store in results.items())
     print("\n")
-    print(f"\tExtracted annotations for  {num_extraced_sentences}  out of total  {TOTAL}  sentences")
-    print(f"\tRelations extracted from this website: {len(results)-curr_len} (Overall: {num_extracted_tuples})")
+    print(f"\tExtracted annotations for  {num_extraced_sentences}  out of total  {total}  sentences")
+    if num_duplicates:
+        print(f"\tSkipped {num_duplicates} sentences already seen in this run")
+        metrics.count("duplicate_sentences", num_duplicates)
+    if num_filtered:
+        print(f"\tRelevance filter kept {num_filtered} candidate sentences away from Gemini")
+        metrics.count("gemini_prefilter_dropped", num_filtered)
+    print(f"\tRelations extracted from this website: {num_new} (Overall: {num_extracted_tuples})")
+    if len(results) > 1:
+        for r, store in results.items():
+            print(f"\t\t{relation_map[r]}: {len(store) - curr_len[r]}")
     print("\n")
+
+
+# Merge what a worker process extracted from one page (see workers.py): the same threshold
+# and max-confidence dedup as extract_relations(), applied in sentence order
+def merge_worker_page(results, page, t, seen_sentences=None):
+    num_extraced_sentences = 0
+    num_extracted_tuples = 0
+    num_duplicates = 0
+    curr_len = {r: len(store) for r, store in results.items()}
+    targets = spanbert_targets(results)
+
+    for key, input_tokens, candidate_pairs, relation_preds in page["sentences"]:
+        if seen_sentences is not None and seen_sentences.seen_key(key):
+            num_duplicates += 1
+            continue
+        metrics.count("sentences")
+        metrics.count("candidate_pairs", len(candidate_pairs))
+        if candidate_pairs:
+            num_extraced_sentences += 1
+            num_extracted_tuples = route_spanbert_predictions(candidate_pairs, relation_preds, input_tokens, targets, num_extracted_tuples, t)
+
+    print_page_summary(results, curr_len, num_extraced_sentences, len(page["sentences"]), num_extracted_tuples, num_duplicates)
     return results
 
-def process_query(q, service, engine_id):
+def fetched_texts(pages, page_dedup=None, skipped=None):
+    """
+    Turn (url, text) pairs from fetch_pages() into (text, url) tuples for nlp.pipe,
+    skipping pages that could not be fetched and, with a PageDeduplicator, pages that
+    are near-duplicates of one already processed. The urls of skipped pages are added
+    to the skipped set.
+    """
+    pages = iter(pages)
+    while True:
+        # Time spent waiting for downloads (see annotate_pages())
+        start = time.perf_counter()
+        try:
+            curr_url, text = next(pages)
+        except StopIteration:
+            return
+        finally:
+            metrics.add_time("fetch_wait", time.perf_counter() - start)
+
+        print(f"Fetched URL: {curr_url}")
+        if text == None:
+            print("Unable to fetch URL. Continuing.")
+            if skipped is not None:
+                skipped.add(curr_url)
+            continue
+        if page_dedup is not None:
+            original = page_dedup.duplicate_of(curr_url, text)
+            if original is not None:
+                print(f"\tNear-duplicate of {original}. Continuing.")
+                metrics.count("duplicate_pages")
+                if skipped is not None:
+                    skipped.add(curr_url)
+                continue
+
+        print(f"\tWebpage length (num characters): {len(text)}")
+        print("\tAnnotating the webpage using spacy...")
+        # Process the text with spaCy (includes tokenization, sentence segmentation, and NER)
+        yield text, curr_url
+
+
+def process_query(q, search_backend, num_results=10):
     """
-    This function processes a search query by calling the Google Custom Search Engine API
-    and returns a list of search results containing the title, URL, and description.
+    This function processes a search query with the run's search backend (Google Custom
+    Search, or a local index with --search-backend local) and returns the urls of the top results.
 
     Parameters:
         q (str): The search query string to be submitted to the search engine.
-        service (object): An authenticated Google API client service object for interacting with the API.
+        search_backend (object): A backend from search_backends.py, with a search(q, num_results) method.
+        num_results (int): Number of results to return (--num-results).
 
     Returns:
-        list: A 2D list where each element is a list in the form [title, url, description].
+        list: The urls of the results, best first.
     """
-    res = (
-        service.cse()
-        .list(
-            q=q,
-            cx=engine_id,
-        )
-        .execute()
-    )
-    results = [item["link"] for item in res["items"]]
+    return search_backend.search(q, num_results)
 
-    return results
 
+def next_query(results, relations, processed_queries, q, query_relation, k):
+    """
+    Return (query, relation) for the next iteration, or (None, None) if ISE has stalled.
+    Relations take turns in the order given, starting after the one that produced q.
+    Relations that still need tuples go first; the tuples of relations that already have
+    k are only used once the others have run out of queries.
+    """
+    start = relations.index(query_relation)
+    turns = [relations[(start + offset) % len(relations)] for offset in range(1, len(relations) + 1)]
+    turns.sort(key=lambda r: len(results[r]) >= k)  # stable: keeps the turn order within each group
+    for r in turns:
+        next_q = results[r].best_unused_query(processed_queries, q)
+        if next_q is not None:
+            return next_q, r
+    return None, None
 
-def main():
-    # Parse and validate all user input from args
-    args = validate_args()
 
-    # Load pre-trained SpanBERT model
-    spanbert = SpanBERT("./pretrained_spanbert")
+def run_results(results):
+    """
+    What run_ise() returns: the results store of a single-relation run, or a
+    MultiRelationResults keyed by relation name.
+    """
+    if len(results) == 1:
+        return next(iter(results.values()))
+    return MultiRelationResults((relation_map[r], store) for r, store in results.items())
+
+
+def annotate_pages(nlp, pages, batch_size, n_process, lock=None):
+    """
+    nlp.pipe() over (text, url) tuples, yielding (doc, url). With a lock (runs sharing the
+    pipeline from several threads), pages are annotated one batch at a time under the lock,
+    so waiting for downloads never blocks the other runs.
+    """
+    if lock is None:
+        yield from nlp.pipe(pages, as_tuples=True, batch_size=batch_size, n_process=n_process)
+        return
+
+    batch = []
+    for page in pages:
+        batch.append(page)
+        if len(batch) == batch_size:
+            with lock:
+                docs = list(nlp.pipe(batch, as_tuples=True, batch_size=batch_size))
+            yield from docs
+            batch = []
+    if batch:
+        with lock:
+            docs = list(nlp.pipe(batch, as_tuples=True, batch_size=batch_size))
+        yield from docs
+
+
+def metered_docs(docs):
+    """
+    Pass (doc, url) pairs through, timing the spaCy stage. nlp.pipe() pulls the pages
+    itself, so the time it spends waiting for downloads (fetch_wait) is taken out.
+    """
+    docs = iter(docs)
+    while True:
+        start = time.perf_counter()
+        waited = metrics.seconds["fetch_wait"]
+        try:
+            doc, url = next(docs)
+        except StopIteration:
+            return
+        metrics.add_time("spacy", time.perf_counter() - start - (metrics.seconds["fetch_wait"] - waited))
+        metrics.count("pages")
+        yield doc, url
+
+
+def run_ise(args, models=None, resources=None, resident_workers=None):
+    """
+    Run iterative set expansion for validated args and return the results store
+    (a MultiRelationResults of one store per relation when --relations lists several).
+    models holds the spaCy/SpanBERT models; they are loaded on first use and can be
+    shared between runs (see daemon.py). resources holds the connections and caches; by
+    default the run builds its own, batch.py shares one ISEResources between jobs.
+    resident_workers is a ResidentWorkerPool that keeps the --workers processes between runs
+    (daemon.py); by default they belong to the resources.
+    """
+    if models is None:
+        models = Models()
 
     # Print to intro to terminal
     print("____")
@@ -223,91 +802,293 @@ def main():
     print(f"Engine key	= XXXXXX")
     print(f"Gemini key	= XXXXXX")
     print(f"Method	    = {args.extraction_method}")
-    print(f"Relation	= {relation_map[args.r]}")
+    print(f"Relation	= {', '.join(relation_map[r] for r in args.relations)}")
     print(f"Threshold	= {args.t}")
     print(f"Query		= {args.q}")
     print(f"# of Tuples	= {args.k}")
     print("Loading necessary libraries; This should take a minute or so ...)")
 
+    # Load pre-trained SpanBERT model (only needed for -spanbert and --gemini-prefilter spanbert; with --workers every worker loads its own)
+    spanbert = None
+    if (args.extraction_method == 'spanbert' and not args.workers) or (args.extraction_method == 'gemini' and args.gemini_prefilter == 'spanbert'):
+        spanbert = models.spanbert(args.spanbert_backend, args.spanbert_threads)
+        if resources is not None and resources.model_lock is not None:
+            spanbert = LockedPredictor(spanbert, resources.model_lock)
+
     # Keep track of URLs that have been processed in previous urls, queries, results
     processed_urls = set()
     processed_queries = set()
-    gemini_res = set()
-    spanbert_res = {}
+    # Every relation has its own results store, which is also its query-expansion frontier
     if args.extraction_method == 'spanbert':
-        results = spanbert_res
+        results = {r: SpanBERTResults() for r in args.relations}
     else:
-        results = gemini_res
-    
-    # Set up for iterations
-    service = build("customsearch", "v1", developerKey=args.google_search_api_key)
+        results = {r: GeminiResults() for r in args.relations}
     num_iteration = 0
     q = args.q
-    nlp = spacy.load("en_core_web_lg")  # Load spacy model
-    requirement = relation_requirements[relation_map[args.r]]
+    query_relation = args.relations[0]  # relation whose tuple q was built from
 
-    while True:
-        processed_queries.add(q)
-        print(f"=========== Iteration: {num_iteration} - Query: {q} ===========\n\n")
-        num_iteration += 1
-
-        # Process query
-        top_urls = process_query(q, service, args.google_engine_id)
-
-        # Process each url
-        count = 0
-        while(count < 10):
-            curr_url = top_urls[count]
-            print(f"URL ( {count+1} / 10): {curr_url}")
-            count += 1
-            if curr_url in processed_urls:
-                print("This URL has already been processed. Continuing.")
-                continue
-            processed_urls.add(curr_url)
+    # Pick up the state of an interrupted run
+    checkpoint_path = args.checkpoint or args.resume
+    resume_iteration = None
+    if args.resume:
+        state = load_checkpoint(args.resume, args)
+        processed_urls = state["processed_urls"]
+        processed_queries = state["processed_queries"]
+        results = state["results"]
+        num_iteration = state["num_iteration"]
+        q = state["q"]
+        query_relation = state["query_relation"]
+        resume_iteration = state["iteration"]
+        print(f"Resuming from checkpoint {args.resume}: iteration {num_iteration}, {sum(len(store) for store in results.values())} tuples, {len(processed_urls)} processed urls")
+        if state["finished"]:
+            print("This run had already finished.")
+            return run_results(results)
 
-            print("\tFetching text from url ...")
-            text = extract_plain_text(curr_url)
-            if text == None:
-                print("Unable to fetch URL. Continuing.")
-                continue
+    # Set up for iterations
+    own_resources = resources is None
+    if own_resources:
+        resources = ISEResources(args)
+    # Released in the finally block below, also when the run fails (ex. a daemon job that raised)
+    report = None
+    profiler = None
+    prefetcher = None
+    try:
+        prediction_cache = resources.prediction_cache
+        worker_pool = None
+        if args.workers and resident_workers is not None:
+            worker_pool = resident_workers.get(args.workers, worker_initargs(args, models))
+        elif args.workers:
+            worker_pool = resources.worker_pool(args.workers, worker_initargs(args, models))
+        else:
+            nlp = models.nlp(args.spacy_fast)  # Load spacy model
+        batcher = None
+        if args.extraction_method == 'spanbert' and args.spanbert_batch != 'sentence' and worker_pool is None:
+            batcher = SpanBERTBatcher(spanbert, args.spanbert_batch_size, prediction_cache, spanbert_model_name(args.spanbert_backend))
+        gemini_client = None
+        if args.extraction_method == 'gemini':
+            gemini_client = resources.gemini_client()
+        relevance = relevance_filter(args, spanbert, prediction_cache)
+        page_dedup = PageDeduplicator(args.dedup_distance) if args.dedup_pages else None
+        seen_sentences = SentenceDeduplicator() if args.dedup_sentences else None
+        context = ExtractionContext(batcher, gemini_client, prediction_cache, seen_sentences, relevance)
 
-            print(f"\tWebpage length (num characters): {len(text)}")
-            print("\tAnnotating the webpage using spacy...")
-            # Process the text with spaCy (includes tokenization, sentence segmentation, and NER)
-            doc = nlp(text)
-            print(f"\tExtracted {len(list(doc.sents))} sentences. Processing each sentence one by one to check for presence of right pair of named entity types; if so, will run the second pipeline ...")
+        def run_search(query):
+            with metrics.stage("search"):
+                return process_query(query, resources.search_backend, args.num_results)
 
-            # Extract relations
-            results = extract_relations(args, results, doc, requirement, spanbert)
+        def search(query):
+            return resources.search(query, args.num_results, lambda: run_search(query))
 
-        updated = False
-        if args.extraction_method == 'gemini':
-            relation = relation_map[args.r]
-            print(f"================== ALL RELATIONS for {relation} ( {len(results)} ) =================")
-            for res in results: # res = (subj, relation_type, obj)
-                print(f"Subject: {res[0]}\t\t| Object: {res[2]}")
-                if f"{res[0]} {res[2]}" not in processed_queries and f"{res[0]} {res[2]}".lower() != q.lower():
-                    q = f"{res[0]} {res[2]}" # update q just in case
-                    updated = True
-        else:
-            # results = {(subj, obj): confidence, ..., (subj, obj): confidence} 
-            relation = internal_map[args.r]
-            print(f"================== ALL RELATIONS for {relation} ( {len(results)} ) =================")
-            for res in results.keys(): # res = (confidence,subj,obj)
-                print(f" Confidence: {results[res]}\t\t| Subject: {res[0]}\t\t| Object: {res[1]}")
-                if f"{res[0]} {res[1]}" not in processed_queries and f"{res[0]} {res[1]}".lower() != q.lower():
-                    q = f"{res[0]} {res[1]}" # update q just in case
-                    updated = True
-
-        # if we reached k tuples
-        if len(results) >= args.k:
-            print(f"Total # of iterations = {num_iteration}")
-            break
+        if args.metrics:
+            report = RunReport(args.metrics, args.metrics_format)
+            metrics.enable()
+
+        prefetched_urls = None
+        if args.prefetch_searches > 0:
+            prefetcher = SearchPrefetcher(search, args.prefetch_searches)
+
+        # URLs of the current iteration whose relations are not final yet; they are left out of
+        # the checkpoint so a resumed run processes them again
+        pending_urls = set()
+
+        def save(iteration=None, finished=False):
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, args, q, query_relation, num_iteration, processed_queries, processed_urls - pending_urls,
+                                results, iteration, finished)
+
+        try:
+            while True:
+                # The search is part of the measured/profiled iteration
+                if report is not None:
+                    report.start_iteration()
+                if args.profile_iteration == (num_iteration - 1 if resume_iteration is not None else num_iteration):
+                    profiler = start_profile()
+
+                if resume_iteration is not None:
+                    # Reuse the search results of the interrupted iteration instead of searching again
+                    top_urls = resume_iteration["top_urls"]
+                    resume_iteration = None
+                    print(f"=========== Iteration: {num_iteration - 1} - Query: {q} (resumed) ===========\n\n")
+                else:
+                    processed_queries.add(q)
+                    print(f"=========== Iteration: {num_iteration} - Query: {q} ===========\n\n")
+                    num_iteration += 1
+
+                    # Process query (unless its search was already prefetched during the last iteration)
+                    if prefetched_urls is not None:
+                        print(f"Using the prefetched search results for: {q}")
+                        top_urls = prefetched_urls
+                    else:
+                        top_urls = search(q)
+                iteration = {"query": q, "top_urls": top_urls}
+
+                # Collect the urls we haven't seen yet so they can all be fetched at once
+                urls_to_fetch = []
+                for count, curr_url in enumerate(top_urls[:args.num_results]):
+                    print(f"URL ( {count+1} / {args.num_results}): {curr_url}")
+                    if curr_url in processed_urls:
+                        print("This URL has already been processed. Continuing.")
+                        continue
+                    processed_urls.add(curr_url)
+                    pending_urls.add(curr_url)
+                    urls_to_fetch.append(curr_url)
+                save(iteration)
+
+                print(f"\tFetching text from {len(urls_to_fetch)} urls ...")
+
+                # Annotate the pages in batches as soon as their downloads finish
+                skipped_urls = set()
+                if resources.search_backend is not None and resources.search_backend.provides_text:
+                    # The pages' text comes from the local index, already extracted
+                    fetched = resources.search_backend.fetch_pages(urls_to_fetch, args.page_max_chars)
+                else:
+                    fetched = fetch_pages(urls_to_fetch, resources.session, args.fetch_workers, resources.page_cache, args.stream_html, resources.page_pool, args.page_max_chars)
+                pages = fetched_texts(fetched, page_dedup, skipped_urls)
+                if worker_pool is not None:
+                    # Pages are annotated and predicted by the workers and merged here in url order
+                    docs = worker_pool.extract_pages(pages, urls_to_fetch, skipped_urls, [relation_requirements[relation_map[r]] for r in args.relations])
+                elif args.page_chunk_chars:
+                    # Page texts go to the loop as they are and are annotated chunk by chunk there
+                    docs = pages
+                else:
+                    docs = annotate_pages(nlp, pages, args.spacy_batch_size, args.spacy_n_process, resources.model_lock)
+                    if metrics.enabled:
+                        docs = metered_docs(docs)
+                for doc, curr_url in docs:
+                    print(f"URL: {curr_url}")
+                    if worker_pool is not None:
+                        print(f"\tExtracted {len(doc['sentences'])} sentences. Merging the SpanBERT predictions of the worker ...")
+                        metrics.count("pages")
+                        if prediction_cache is not None:
+                            prediction_cache.hits += doc["cache_hits"]
+                            prediction_cache.misses += doc["cache_misses"]
+                        metrics.merge(doc["metrics"])
+                        if doc["budget_dropped"]:
+                            print(f"\tThe time budget of this page ran out before {doc['budget_dropped']} candidate sentences were sent to SpanBERT")
+                        if doc["budget_stopped"]:
+                            print(f"\t{doc['budget_stopped']}")
+                        results = merge_worker_page(results, doc, args.t, seen_sentences)
+                    elif args.page_chunk_chars:
+                        text = doc
+                        estimate = estimate_sentences(text)
+                        metrics.count("pages")
+                        print(f"\tAbout {estimate} sentences. Annotating and processing them in chunks of up to {args.page_chunk_chars} characters ...")
+                        budget = page_budget(args)
+                        sentences = budgeted(chunked_sentences(nlp, text, args.page_chunk_chars, resources.model_lock), budget)
+                        results = extract_relations(args, results, None, spanbert, sentences, context=context, url=curr_url, total=f"~{estimate}", budget=budget)
+                        if budget.stopped:
+                            print(f"\t{budget.stopped}")
+                    else:
+                        sentences = list(doc.sents)
+                        print(f"\tExtracted {len(sentences)} sentences. Processing each sentence one by one to check for presence of right pair of named entity types; if so, will run the second pipeline ...")
+
+                        # Extract relations
+                        budget = page_budget(args)
+                        results = extract_relations(args, results, doc, spanbert, budgeted(sentences, budget), context=context, url=curr_url, total=len(sentences), budget=budget)
+                        if budget.stopped:
+                            print(f"\t{budget.stopped}")
+
+                    # With --spanbert-batch iteration the page's pairs are only predicted after the loop
+                    if batcher is None or args.spanbert_batch != 'iteration':
+                        pending_urls.discard(curr_url)
+                        save(iteration)
+
+                    if args.stop_early and all(len(store) >= args.k for store in results.values()):
+                        print(f"Reached {args.k} tuples. Skipping the remaining webpages of this iteration.")
+                        break
+
+                    # Search for the tuple most likely to be the next query while the other pages are processed
+                    if prefetcher is not None:
+                        prefetcher.prefetch(next_query(results, args.relations, processed_queries, q, query_relation, args.k)[0])
+                # Stop the downloads (and worker tasks) still in flight if the loop ended early
+                docs.close()
+                pages.close()
+
+                # Predict the candidate pairs queued from every page of this iteration at once
+                if batcher is not None and len(batcher) > 0:
+                    curr_len = sum(len(store) for store in results.values())
+                    print(f"\tRunning SpanBERT on {sum(len(p[0]) for p in batcher.pending)} candidate pairs from {len(batcher)} sentences of this iteration ...")
+                    num_extracted_tuples = batcher.flush(spanbert_targets(results), 0, args.t)
+                    print(f"\tRelations extracted from this iteration: {sum(len(store) for store in results.values())-curr_len} (Overall: {num_extracted_tuples})\n")
+                # Every url of the iteration is done, including those that could not be fetched
+                pending_urls.clear()
+
+                for r, store in results.items():
+                    if args.extraction_method == 'gemini':
+                        relation = relation_map[r]
+                        print(f"================== ALL RELATIONS for {relation} ( {len(store)} ) =================")
+                        for res in store: # res = (subj, relation_type, obj)
+                            print(f"Subject: {res[0]}\t\t| Object: {res[2]}")
+                    else:
+                        # store = {(subj, obj): confidence, ..., (subj, obj): confidence} in descending confidence
+                        relation = internal_map[r]
+                        print(f"================== ALL RELATIONS for {relation} ( {len(store)} ) =================")
+                        for res, confidence in store.items(): # res = (subj, obj)
+                            print(f" Confidence: {confidence}\t\t| Subject: {res[0]}\t\t| Object: {res[1]}")
+
+                # Pick the best tuple that hasn't been used as a query yet, taking turns between relations
+                next_q, next_relation = next_query(results, args.relations, processed_queries, q, query_relation, args.k)
+                updated = next_q is not None
+                if updated:
+                    q, query_relation = next_q, next_relation
+
+                if profiler is not None:
+                    stop_profile(profiler, args.profile_output)
+                    profiler = None
+                if report is not None:
+                    report.end_iteration(num_iteration - 1, iteration["query"], sum(len(store) for store in results.values()))
+                    report.write(sum(len(store) for store in results.values()), resources.counters())
+
+                # if we reached k tuples (for every relation)
+                if all(len(store) >= args.k for store in results.values()):
+                    print(f"Total # of iterations = {num_iteration}")
+                    save(finished=True)
+                    break
         
-        # if there was no q
-        if not updated:
-            print("ISE has 'stalled' before retrieving k high-confidence tuples")
-            break
+                # if there was no q
+                if not updated:
+                    print("ISE has 'stalled' before retrieving k high-confidence tuples")
+                    save(finished=True)
+                    break
+
+                if prefetcher is not None:
+                    prefetched_urls = prefetcher.take(q)
+                save()
+        except KeyboardInterrupt:
+            if checkpoint_path:
+                print(f"Interrupted. Continue this run with --resume {checkpoint_path}")
+            raise
+
+        if relevance is not None:
+            # Without batching every dropped sentence is a Gemini call saved (unless it was cached)
+            saved = f" ({relevance.dropped} calls saved)" if args.gemini_batch_tokens <= 0 else ""
+            print(f"Relevance filter: {relevance.dropped} of {relevance.kept + relevance.dropped} candidate sentences not sent to Gemini{saved}")
+        if page_dedup is not None:
+            print(f"Near-duplicate pages skipped: {page_dedup.skipped}")
+        if seen_sentences is not None:
+            print(f"Duplicate sentences skipped: {seen_sentences.skipped}")
+        if prefetcher is not None:
+            print(f"Speculative searches: {prefetcher.used} used, {prefetcher.discarded} discarded")
+        if report is not None:
+            report.write(sum(len(store) for store in results.values()), resources.counters())
+            print(f"Metrics report saved to {args.metrics}")
+
+        return run_results(results)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if prefetcher is not None:
+            prefetcher.close()
+        if report is not None:
+            metrics.disable()
+        if own_resources:
+            resources.close()
+
+
+def main():
+    # Parse and validate all user input from args
+    args = validate_args()
+    run_ise(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,42 @@
+import threading
+import spacy
+from spanbert_backends import load_spanbert
+
+# spaCy components whose output is never read by the extractors (see --spacy-fast)
+unused_spacy_pipes = ["tagger", "attribute_ruler", "lemmatizer"]
+
+
+class Models:
+    """
+    The spaCy pipeline and SpanBERT, each loaded the first time a run needs it and then kept
+    for every later run in the same process (see daemon.py). A Gemini run never loads SpanBERT.
+    """
+
+    def __init__(self, spanbert_dir="./pretrained_spanbert"):
+        self.spanbert_dir = spanbert_dir
+        self._nlp = {}  # fast flag -> loaded pipeline
+        self._spanbert = {}  # backend -> loaded SpanBERT
+        self._lock = threading.Lock()
+
+    def nlp(self, fast=False):
+        """
+        Load the spaCy pipeline. With fast=True, only the components the extractors need
+        (tok2vec, parser for sentence boundaries, ner) are kept running.
+        """
+        with self._lock:
+            if fast not in self._nlp:
+                nlp = spacy.load("en_core_web_lg")
+                if fast:
+                    nlp.select_pipes(disable=[pipe for pipe in unused_spacy_pipes if pipe in nlp.pipe_names])
+                self._nlp[fast] = nlp
+            return self._nlp[fast]
+
+    def spanbert(self, backend="torch", threads=None):
+        """
+        Load SpanBERT with the given backend (see spanbert_backends.py). threads only
+        applies when that backend is loaded for the first time.
+        """
+        with self._lock:
+            if backend not in self._spanbert:
+                self._spanbert[backend] = load_spanbert(self.spanbert_dir, backend, threads)
+            return self._spanbert[backend]
@@ -0,0 +1,128 @@
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+# One cached webpage: the raw html plus the cleaned text extract_plain_text() produced from it
+CachedPage = namedtuple("CachedPage", ["url", "html", "text", "max_length", "etag", "last_modified", "fetched_at"])
+
+
+class PageCache:
+    """
+    Persistent cache of downloaded webpages stored in a SQLite file.
+
+    Each entry keeps the zlib-compressed raw html, the cleaned/truncated text and the
+    ETag / Last-Modified validators of the response. Entries younger than ttl seconds are
+    served without touching the network; older ones are revalidated with a conditional
+    GET. When the stored bytes exceed max_bytes the least recently used pages are evicted.
+    """
+
+    def __init__(self, path, ttl=24 * 60 * 60, max_bytes=500 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        # The fetch stage runs in a thread pool, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                html BLOB,
+                text TEXT,
+                max_length INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                accessed_at REAL,
+                size INTEGER
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def get(self, url):
+        """
+        Return the CachedPage stored for url (fresh or stale), or None if there is none.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, html, text, max_length, etag, last_modified, fetched_at FROM pages WHERE url = ?",
+                (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+        html = zlib.decompress(row[1]).decode("utf-8")
+        return CachedPage(row[0], html, row[2], row[3], row[4], row[5], row[6])
+
+    def count(self, hits=0, revalidated=0, misses=0):
+        """
+        Add to the lookup counters. extract_plain_text() runs in the fetch thread pool, so they
+        are updated under the lock.
+        """
+        with self._lock:
+            self.hits += hits
+            self.revalidated += revalidated
+            self.misses += misses
+
+    def is_fresh(self, page):
+        return time.time() - page.fetched_at < self.ttl
+
+    def put(self, url, html, text, max_length, etag=None, last_modified=None, fetched_at=None):
+        """
+        Store (or replace) a page and evict least recently used pages if the cache is over budget.
+        """
+        blob = zlib.compress(html.encode("utf-8"))
+        size = len(blob) + len(text.encode("utf-8"))
+        now = time.time()
+        if fetched_at is None:
+            fetched_at = now
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM pages WHERE url = ?", (url,)).fetchone()
+            if old is not None:
+                self._total_bytes -= old[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, blob, text, max_length, etag, last_modified, fetched_at, now, size)
+            )
+            self._total_bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def refresh(self, url, headers=None):
+        """
+        Mark a stale page as fresh again after the server answered 304 Not Modified. The ETag /
+        Last-Modified validators of the 304 response (headers) replace the stored ones.
+        """
+        headers = headers or {}
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET fetched_at = ?, accessed_at = ?, etag = COALESCE(?, etag), "
+                "last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                (now, now, headers.get('ETag'), headers.get('Last-Modified'), url)
+            )
+            self._conn.commit()
+
+    def _evict(self):
+        # Drop the least recently used pages until we are back under the byte budget
+        while self._total_bytes > self.max_bytes:
+            row = self._conn.execute("SELECT url, size FROM pages ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                self._total_bytes = 0
+                break
+            self._conn.execute("DELETE FROM pages WHERE url = ?", (row[0],))
+            self._total_bytes -= row[1]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
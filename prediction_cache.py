@@ -0,0 +1,84 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    Persistent memo of relation predictions, stored in a SQLite file with an in-memory
+    LRU in front of it.
+
+    Keys are a hash of (method, relation, model name, payload), where payload is what the
+    model actually saw: the sentence tokens for Gemini, or the tokens and subject/object
+    spans of a candidate pair for SpanBERT. Values are any JSON-serializable prediction:
+    the parsed tuples for Gemini, or the (relation, confidence) pair for SpanBERT.
+    """
+
+    def __init__(self, path, lru_size=10000, timeout=60):
+        self.path = path
+        self.lru_size = lru_size
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+
+        # Gemini requests are sent from a thread pool, so share one connection behind a lock
+        self._lock = threading.Lock()
+        # With --workers every worker process writes to the same file: WAL lets readers go on
+        # during a write, and writers wait up to timeout seconds for the lock instead of failing
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(method, relation, model_name, payload):
+        data = json.dumps([method, relation, model_name, payload], ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached prediction for key, or None on a miss.
+        """
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return self._lru[key]
+
+            row = self._conn.execute("SELECT value FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            value = json.loads(row[0])
+            self._remember(key, value)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        """
+        Store several (key, value) pairs in one transaction.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in items]
+            )
+            self._conn.commit()
+            for key, value in items:
+                self._remember(key, value)
+
+    def _remember(self, key, value):
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,101 @@
+from spanbert_process import predict_with_cache
+from spacy_help_functions import matches_requirement
+
+# Words that often show up in sentences expressing a relation. Strong triggers alone score
+# 1.0, weak ones 0.5; a sentence scores the sum of its distinct triggers, capped at 1.0.
+relation_triggers = {
+    "Schools_Attended": {
+        "strong": ["graduated", "graduate", "graduates", "graduating", "graduation", "alumnus", "alumna", "alumni",
+                   "attended", "attends", "attend", "attending", "enrolled", "studied", "studying", "degree", "diploma",
+                   "dropped", "dropout", "phd", "doctorate", "bachelor", "masters", "mba", "matriculated", "educated",
+                   "dissertation", "thesis"],
+        "weak": ["university", "college", "school", "academy", "institute", "student", "students", "studies",
+                 "class", "campus", "faculty", "professor", "scholarship"],
+    },
+    "Work_For": {
+        "strong": ["works", "worked", "working", "employed", "employee", "employees", "employer", "joined", "hired",
+                   "ceo", "founder", "founded", "cofounder", "co-founder", "president", "chairman", "chairwoman",
+                   "director", "executive", "manager", "engineer", "officer", "chief", "head", "serves", "served",
+                   "leads", "led", "resigned", "retired", "intern", "analyst", "consultant"],
+        "weak": ["company", "job", "career", "role", "team", "staff", "member", "position", "firm", "corporation",
+                 "board", "partner", "vice"],
+    },
+    "Live_In": {
+        "strong": ["lives", "lived", "live", "living", "resides", "resided", "resident", "residence", "home",
+                   "moved", "relocated", "raised", "grew", "born", "native", "settled", "hometown"],
+        "weak": ["house", "apartment", "mansion", "city", "stayed", "neighborhood", "family", "childhood"],
+    },
+    "Top_Member_Employees": {
+        "strong": ["ceo", "founder", "founded", "cofounder", "co-founder", "chairman", "chairwoman", "president",
+                   "chief", "executive", "director", "head", "owner", "led", "leads", "cto", "cfo", "coo"],
+        "weak": ["leader", "leadership", "manager", "partner", "boss", "board", "vice", "managing", "senior"],
+    },
+}
+
+
+class LexicalScorer:
+    """
+    Score how likely a candidate sentence expresses a relation from its trigger words.
+    """
+
+    def __init__(self, triggers=relation_triggers):
+        self.weights = {}  # relation -> word -> weight
+        for relation, words in triggers.items():
+            weights = {word: 0.5 for word in words["weak"]}
+            weights.update({word: 1.0 for word in words["strong"]})
+            self.weights[relation] = weights
+
+    def scores(self, sentence, candidate_pairs, relations):
+        """
+        One score in [0, 1] per relation in relations (names, ex. "Work_For").
+        """
+        words = {token.text.lower() for token in sentence}
+        return [min(1.0, sum((weight for word, weight in self.weights[relation].items() if word in words), 0.0))
+                for relation in relations]
+
+
+class SpanBERTScorer:
+    """
+    Score a candidate sentence with SpanBERT's own predictions: the highest confidence of a
+    candidate pair predicted as the relation (0 if none is). The pairs of a sentence are
+    predicted once for every relation, and go through the PredictionCache like a SpanBERT run.
+    """
+
+    def __init__(self, spanbert, labels, requirements, cache=None, model_name="pretrained_spanbert"):
+        self.spanbert = spanbert
+        self.labels = labels  # relation name -> SpanBERT label (ex. "per:employee_of")
+        self.requirements = requirements  # relation name -> entity type requirement
+        self.cache = cache
+        self.model_name = model_name
+
+    def scores(self, sentence, candidate_pairs, relations):
+        relation_preds = predict_with_cache(self.spanbert, candidate_pairs, self.cache, self.model_name)
+        scores = []
+        for relation in relations:
+            confidences = [pred[1] for pair, pred in zip(candidate_pairs, relation_preds)
+                           if pred[0] == self.labels[relation] and matches_requirement(pair, self.requirements[relation])]
+            scores.append(max(confidences, default=0.0))
+        return scores
+
+
+class RelevanceFilter:
+    """
+    Decide which candidate sentences are worth a Gemini call: only sentences whose score for
+    the relation reaches the threshold are kept (see --gemini-prefilter).
+    """
+
+    def __init__(self, scorer, threshold=0.5):
+        self.scorer = scorer
+        self.threshold = threshold
+        self.kept = 0
+        self.dropped = 0
+
+    def keep(self, sentence, candidate_pairs, relations):
+        """
+        The relations (of the given names) the sentence should be sent to Gemini for.
+        """
+        kept = [relation for relation, score in zip(relations, self.scorer.scores(sentence, candidate_pairs, relations))
+                if score >= self.threshold]
+        self.kept += len(kept)
+        self.dropped += len(relations) - len(kept)
+        return kept
@@ -0,0 +1,227 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from gemini import GeminiClient
+from page_cache import PageCache
+from prediction_cache import PredictionCache
+from web_fetch import make_session
+from fixtures import FixtureStore
+from workers import WorkerPool
+from search_backends import make_search_backend
+
+
+class SharedMemo:
+    """
+    Thread-safe memo where each key is computed once: callers asking for a key that is
+    already being computed wait for that result instead of computing it again. A None result
+    (ex. a failed download) is handed to those waiting callers but not remembered, so a
+    transient error doesn't block the key for the rest of the batch.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if owner:
+            try:
+                result = compute()
+            except BaseException as e:
+                # Don't remember failures; the next caller tries again
+                with self._lock:
+                    del self._futures[key]
+                future.set_exception(e)
+            else:
+                if result is None:
+                    with self._lock:
+                        del self._futures[key]
+                future.set_result(result)
+        return future.result()
+
+
+class LockedPredictor:
+    """
+    Wrap a model so that predict() calls from concurrent runs take turns.
+    """
+
+    def __init__(self, model, lock):
+        self.model = model
+        self.lock = lock
+
+    def predict(self, *args, **kwargs):
+        with self.lock:
+            return self.model.predict(*args, **kwargs)
+
+
+class SearchPrefetcher:
+    """
+    Run the search of the likely next query in the background while the pages of the
+    current iteration are still being processed.
+
+    At most max_searches speculative searches are sent per iteration. take() hands over the
+    urls of the query that actually won; the other speculative results are discarded.
+    """
+
+    def __init__(self, search, max_searches=1):
+        self.search = search  # q -> list of urls
+        self.max_searches = max_searches
+        self.used = 0
+        self.discarded = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures = {}  # query -> Future of its urls, for the current iteration
+
+    def prefetch(self, q):
+        if q is None or q in self._futures or len(self._futures) >= self.max_searches:
+            return
+        self._futures[q] = self._executor.submit(self.search, q)
+
+    def take(self, q):
+        """
+        Return the prefetched urls of q, or None if q wasn't prefetched (or its search failed),
+        and start over for the next iteration.
+        """
+        future = self._futures.pop(q, None)
+        for other in self._futures.values():
+            other.cancel()
+        self.discarded += len(self._futures)
+        self._futures = {}
+
+        if future is None:
+            return None
+        try:
+            urls = future.result()
+        except Exception:
+            # The caller searches again the regular way
+            return None
+        self.used += 1
+        return urls
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Options an ISEResources is built from. Runs that share one (batch.py) must agree on them.
+resource_options = ["page_cache", "page_cache_ttl", "page_cache_max_mb", "prediction_cache", "prediction_cache_lru",
+                    "gemini_concurrency", "gemini_rpm", "gemini_tpm", "search_backend", "search_index", "record", "replay"]
+
+
+class ISEResources:
+    """
+    Everything a run uses besides the models: the search backend, the http session, the
+    page/prediction caches and the Gemini client.
+
+    run_ise() builds its own for a single run. batch.py builds one with shared=True and hands
+    it to every job, which adds an in-memory pool of fetched pages and a memo of search
+    results (so a url or query needed by several jobs is fetched/searched once), and a lock
+    that makes concurrent jobs take turns on spaCy and SpanBERT.
+
+    With --record / --replay, searches, webpage downloads and Gemini completions also go
+    through a FixtureStore.
+    """
+
+    def __init__(self, args, shared=False, max_connections=None):
+        self.fixtures = None
+        if args.record:
+            self.fixtures = FixtureStore(args.record, "record")
+        elif args.replay:
+            self.fixtures = FixtureStore(args.replay, "replay")
+
+        # A replayed run never searches Google; a local index is always opened (it also serves the page texts)
+        self.search_backend = None
+        if self.fixtures is None or not self.fixtures.replaying or args.search_backend == "local":
+            self.search_backend = make_search_backend(args)
+        self.session = make_session(max_connections or args.fetch_workers)  # Shared keep-alive connections for webpage downloads
+        if self.fixtures is not None:
+            self.fixtures.mount(self.session, max_connections or args.fetch_workers)
+        self.page_cache = None
+        if args.page_cache:
+            self.page_cache = PageCache(args.page_cache, ttl=args.page_cache_ttl, max_bytes=args.page_cache_max_mb * 1024 * 1024)
+        self.prediction_cache = None
+        if args.prediction_cache:
+            self.prediction_cache = PredictionCache(args.prediction_cache, lru_size=args.prediction_cache_lru)
+        self.gemini_api_key = args.google_gemini_api_key
+        self.gemini_settings = dict(max_in_flight=args.gemini_concurrency, requests_per_min=args.gemini_rpm, tokens_per_min=args.gemini_tpm)
+        self._gemini_client = None
+        self._worker_pool = None
+        self._lock = threading.Lock()
+
+        self.shared = shared
+        self.page_pool = SharedMemo() if shared else None
+        self.searches = SharedMemo() if shared else None
+        self.model_lock = threading.Lock() if shared else None
+
+    def gemini_client(self):
+        """
+        The Gemini client, created on first use. One client per API key keeps every
+        concurrent job inside the same request/token quota.
+        """
+        with self._lock:
+            if self._gemini_client is None:
+                self._gemini_client = GeminiClient(self.gemini_api_key, fixtures=self.fixtures, **self.gemini_settings)
+            return self._gemini_client
+
+    def worker_pool(self, num_workers, initargs):
+        """
+        The extraction worker processes (see --workers), started on first use. Every run
+        using these resources shares them, with the settings of the first one.
+        """
+        with self._lock:
+            if self._worker_pool is None:
+                self._worker_pool = WorkerPool(num_workers, initargs)
+            return self._worker_pool
+
+    def search(self, q, num_results, run_search):
+        """
+        Return run_search() (the top num_results search results of q), remembered per query
+        and number of results when shared.
+        """
+        if self.fixtures is not None:
+            live_search = run_search
+            run_search = lambda: self.fixtures.search(q, num_results, live_search)
+        if self.searches is None:
+            return run_search()
+        return self.searches.get((q, num_results), run_search)
+
+    def counters(self):
+        """
+        Cache and sharing counts of the resources, for the metrics report.
+        """
+        counts = {}
+        if self.page_cache is not None:
+            counts.update(page_cache_hits=self.page_cache.hits, page_cache_revalidated=self.page_cache.revalidated,
+                          page_cache_misses=self.page_cache.misses)
+        if self.prediction_cache is not None:
+            counts.update(prediction_cache_hits=self.prediction_cache.hits, prediction_cache_misses=self.prediction_cache.misses)
+        if self.page_pool is not None:
+            counts.update(shared_pages_reused=self.page_pool.hits, shared_searches_reused=self.searches.hits)
+        return counts
+
+    def close(self):
+        if self.search_backend is not None:
+            self.search_backend.close()
+        if self._gemini_client is not None:
+            self._gemini_client.close()
+        if self._worker_pool is not None:
+            self._worker_pool.close()
+        if self.prediction_cache is not None:
+            print(f"Prediction cache: {self.prediction_cache.hits} hits, {self.prediction_cache.misses} misses")
+            self.prediction_cache.close()
+        if self.page_cache is not None:
+            print(f"Page cache: {self.page_cache.hits} hits, {self.page_cache.revalidated} revalidated, {self.page_cache.misses} misses")
+            self.page_cache.close()
+        if self.page_pool is not None:
+            print(f"Shared pages: {self.page_pool.hits} reused, {self.page_pool.misses} fetched")
+            print(f"Shared searches: {self.searches.hits} reused, {self.searches.misses} sent")
+        if self.fixtures is not None and self.fixtures.replaying:
+            print(f"Replay: {self.fixtures.misses} requests were not recorded")
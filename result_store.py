@@ -0,0 +1,182 @@
+import heapq
+
+
+class SpanBERTResults:
+    """
+    Extracted SpanBERT tuples: {(subj, obj): confidence}, kept in descending confidence order.
+
+    Behaves like the dict the SpanBERT extraction used to rebuild and re-sort after every
+    sentence, and is filled by route_spanbert_predictions(), but each update is O(log n): a
+    heap indexed by (subj, obj) tracks the order and stale heap entries are dropped lazily.
+    The heap also serves as the query-expansion frontier, so the next seed query is found
+    without scanning every result.
+    """
+
+    def __init__(self):
+        self._confidence = {}  # (subj, obj) -> confidence
+        self._first_seen = {}  # (subj, obj) -> insertion counter, breaks confidence ties
+        self._frontier = []  # heap of (-confidence, first_seen, (subj, obj))
+        self._ordered = None  # cached list of keys in confidence order
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._confidence)
+
+    def __contains__(self, key):
+        return key in self._confidence
+
+    def __getitem__(self, key):
+        return self._confidence[key]
+
+    def __setitem__(self, key, confidence):
+        if key not in self._first_seen:
+            self._first_seen[key] = self._counter
+            self._counter += 1
+        self._confidence[key] = confidence
+        heapq.heappush(self._frontier, (-confidence, self._first_seen[key], key))
+        self._ordered = None
+
+    def get(self, key, default=None):
+        return self._confidence.get(key, default)
+
+    def add(self, subj, obj, confidence):
+        """
+        Keep (subj, obj) with the highest confidence seen. Returns True if the tuple was stored.
+        """
+        if (subj, obj) in self._confidence and confidence < self._confidence[(subj, obj)]:
+            return False
+        self[(subj, obj)] = confidence
+        return True
+
+    def keys(self):
+        if self._ordered is None:
+            self._ordered = sorted(self._confidence, key=lambda key: (-self._confidence[key], self._first_seen[key]))
+        return list(self._ordered)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(key, self._confidence[key]) for key in self.keys()]
+
+    def as_records(self):
+        """
+        JSON-friendly list of the results in confidence order.
+        """
+        return [{"subj": key[0], "obj": key[1], "confidence": confidence} for key, confidence in self.items()]
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Rebuild the results from as_records() output (e.g. a checkpoint).
+        """
+        results = cls()
+        for record in records:
+            results[(record["subj"], record["obj"])] = record["confidence"]
+        return results
+
+    @staticmethod
+    def query_for(key):
+        return f"{key[0]} {key[1]}"
+
+    def best_unused_query(self, processed_queries, q):
+        """
+        Return the query built from the highest-confidence tuple that hasn't been used as a
+        query yet (and isn't the current query q), or None if every tuple was used.
+        """
+        skipped = []
+        best = None
+        while self._frontier:
+            neg_confidence, first_seen, key = self._frontier[0]
+            # Outdated entry: the tuple was later stored with a higher confidence
+            if self._confidence.get(key) != -neg_confidence:
+                heapq.heappop(self._frontier)
+                continue
+            query = self.query_for(key)
+            # Queries never become unused again, so their entries can be dropped for good
+            if query in processed_queries:
+                heapq.heappop(self._frontier)
+                continue
+            if query.lower() == q.lower():
+                skipped.append(heapq.heappop(self._frontier))
+                continue
+            best = query
+            break
+        for entry in skipped:
+            heapq.heappush(self._frontier, entry)
+        return best
+
+
+class GeminiResults:
+    """
+    Extracted Gemini tuples: a set of (subj, relation, obj) that remembers insertion order.
+
+    best_unused_query() walks a cursor forward over the tuples in the order they were
+    extracted, so picking the next seed query doesn't rescan results already used.
+    """
+
+    def __init__(self):
+        self._tuples = {}  # insertion-ordered set
+        self._order = []
+        self._cursor = 0
+
+    def __len__(self):
+        return len(self._tuples)
+
+    def __contains__(self, relation):
+        return relation in self._tuples
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def add(self, relation):
+        if relation not in self._tuples:
+            self._tuples[relation] = None
+            self._order.append(relation)
+
+    def as_records(self):
+        """
+        JSON-friendly list of the results in extraction order.
+        """
+        return [{"subj": relation[0], "relation": relation[1], "obj": relation[2]} for relation in self._order]
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Rebuild the results from as_records() output (e.g. a checkpoint).
+        """
+        results = cls()
+        for record in records:
+            results.add((record["subj"], record["relation"], record["obj"]))
+        return results
+
+    @staticmethod
+    def query_for(relation):
+        return f"{relation[0]} {relation[2]}"
+
+    def best_unused_query(self, processed_queries, q):
+        """
+        Return the query built from the earliest extracted tuple that hasn't been used as a
+        query yet (and isn't the current query q), or None if every tuple was used.
+        """
+        # Skip tuples whose query was already used; they stay used
+        while self._cursor < len(self._order) and self.query_for(self._order[self._cursor]) in processed_queries:
+            self._cursor += 1
+
+        for i in range(self._cursor, len(self._order)):
+            query = self.query_for(self._order[i])
+            if query not in processed_queries and query.lower() != q.lower():
+                return query
+        return None
+
+
+class MultiRelationResults(dict):
+    """
+    Results of a multi-relation run: relation name -> SpanBERTResults / GeminiResults.
+    """
+
+    def as_records(self):
+        """
+        JSON-friendly dict of each relation's records.
+        """
+        return {relation: results.as_records() for relation, results in self.items()}
@@ -0,0 +1,84 @@
+from googleapiclient.discovery import build
+from local_index import LocalIndex
+from web_fetch import print_trimming
+
+search_backends = ["google", "local"]
+
+
+class GoogleSearch:
+    """
+    Google Custom Search (the default backend). Returns urls only; their pages are downloaded
+    and cleaned by web_fetch.fetch_pages().
+    """
+    provides_text = False
+    max_results = 100  # The API serves results 1 to 100, 10 per request
+
+    def __init__(self, api_key, engine_id):
+        self.service = build("customsearch", "v1", developerKey=api_key)
+        self.engine_id = engine_id
+
+    def search(self, q, num_results=10):
+        """
+        The urls of the top num_results results of q, one API request per 10 results.
+        """
+        num_results = min(num_results, self.max_results)
+        urls = []
+        while len(urls) < num_results:
+            num = min(10, num_results - len(urls))
+            res = (
+                self.service.cse()
+                .list(
+                    q=q,
+                    cx=self.engine_id,
+                    num=num,
+                    start=len(urls) + 1,
+                )
+                .execute()
+            )
+            items = res.get("items", [])
+            urls.extend(item["link"] for item in items)
+            if len(items) < num:
+                break  # No more results
+        return urls
+
+    def close(self):
+        self.service.close()
+
+
+class LocalSearch:
+    """
+    BM25 search over a LocalIndex built from pages kept on disk (see local_index.py). The
+    index stores the text of every page, so fetch_pages() reads it from there instead of
+    downloading and parsing the page.
+    """
+    provides_text = True
+
+    def __init__(self, index_dir):
+        self.index = LocalIndex(index_dir)
+
+    def search(self, q, num_results=10):
+        return [url for url, _ in self.index.search(q, num_results)]
+
+    def fetch_pages(self, urls, max_length=10000):
+        """
+        Yield (url, text) for every url like web_fetch.fetch_pages(), with the stored text
+        truncated to max_length. text is None for urls that are not in the index.
+        """
+        for url in urls:
+            text = self.index.text(url)
+            if text is not None:
+                print_trimming(len(text), max_length)
+                text = text[:max_length]
+            yield url, text
+
+    def close(self):
+        self.index.close()
+
+
+def make_search_backend(args):
+    """
+    The search backend chosen with --search-backend.
+    """
+    if args.search_backend == "local":
+        return LocalSearch(args.search_index)
+    return GoogleSearch(args.google_search_api_key, args.google_engine_id)
@@ -84,4 +84,102 @@ def create_entity_pairs(sents_doc, entities_of_interest, window_size=40):
                 if e2.start == e2.end:
                     assert x[e2.start-gap] == e2.text, "{}, {}".format(e2_info, x)
                 entity_pairs.append((x, e1_info, e2_info))
-    return entity_pairs
\ No newline at end of file
+    return entity_pairs
+
+def create_candidate_pairs(sents_doc, entities_of_interest, requirement, window_size=40):
+    '''
+    Input: a spaCy Sentence object, a list of entities of interest and a relation requirement
+           ({"subj": type, "obj": [types]}) or a list of requirements
+    Output: list of candidate pairs {"tokens": x, "subj": entity, "obj": entity} whose subject
+            and object types match the requirement (any of the requirements)
+
+    Same output as running create_entity_pairs() and then keeping the (e1, e2) / (e2, e1)
+    orderings that match the requirement, but only type-compatible entities are paired,
+    punctuation boundaries are computed once per sentence and pairs with the same window
+    share one token list. With several requirements the pairs are built once and can be
+    split per relation with matches_requirement().
+    '''
+    requirements = requirement if isinstance(requirement, list) else [requirement]
+    labels_of_interest = {bert2spacy[b] for b in entities_of_interest}
+    type_pairs = {(req["subj"], obj_type) for req in requirements for obj_type in req["obj"]}  # (subj type, obj type)
+    arg_types = {t for type_pair in type_pairs for t in type_pair}
+
+    # Only entities that can be a subject or an object of the relation can be part of a candidate
+    ents = []
+    for e in sents_doc.ents:
+        if e.label_ not in labels_of_interest:
+            continue
+        ent_type = spacy2bert[e.label_]
+        if ent_type in arg_types:
+            ents.append((e, ent_type, e.text.lower()))
+    if len(ents) < 2:
+        return []
+
+    sent_start = sents_doc.start
+    length_doc = len(sents_doc)
+    tokens = None
+    prev_punct = next_punct = None
+    windows = {}
+
+    candidate_pairs = []
+    for i in range(len(ents)):
+        e1, type1, lower1 = ents[i]
+        for j in range(i + 1, len(ents)):
+            e2, type2, lower2 = ents[j]
+
+            as_ordered = (type1, type2) in type_pairs  # e1=Subject, e2=Object
+            as_swapped = (type2, type1) in type_pairs  # e1=Object, e2=Subject
+            if not (as_ordered or as_swapped):
+                continue
+            if lower1 == lower2: # make sure e1 != e2
+                continue
+            if not (1 <= (e2.start - e1.end) <= window_size):
+                continue
+
+            if tokens is None:
+                # Per sentence: token texts and the closest punctuation at or before / at or after each token
+                tokens = [token.text for token in sents_doc]
+                prev_punct = [-1] * length_doc
+                last = -1
+                for k, token in enumerate(sents_doc):
+                    if token.is_punct:
+                        last = k
+                    prev_punct[k] = last
+                next_punct = [length_doc] * length_doc
+                last = length_doc
+                for k in range(length_doc - 1, -1, -1):
+                    if sents_doc[k].is_punct:
+                        last = k
+                    next_punct[k] = last
+
+            # Start of the window: just after the last punctuation before e1 (see create_entity_pairs)
+            before = e1.start - 1 - sent_start
+            p = prev_punct[before] if before > 0 else -1
+            left_r = p + 1 if p >= 2 else 0
+
+            # End of the window: just after the first punctuation after e2
+            after = e2.end - sent_start
+            right_r = min(next_punct[after] + 1, length_doc) if after < length_doc else length_doc
+
+            if (right_r - left_r) > window_size: # sentence should not be longer than window_size
+                continue
+
+            x = windows.get((left_r, right_r))
+            if x is None:
+                x = tokens[left_r:right_r]
+                windows[(left_r, right_r)] = x
+            gap = sent_start + left_r
+            e1_info = (e1.text, type1, (e1.start - gap, e1.end - gap - 1))
+            e2_info = (e2.text, type2, (e2.start - gap, e2.end - gap - 1))
+            if as_ordered:
+                candidate_pairs.append({"tokens": x, "subj": e1_info, "obj": e2_info})
+            if as_swapped:
+                candidate_pairs.append({"tokens": x, "subj": e2_info, "obj": e1_info})
+    return candidate_pairs
+
+
+def matches_requirement(pair, requirement):
+    '''
+    True if the subject and object types of a candidate pair match a relation requirement.
+    '''
+    return pair["subj"][1] == requirement["subj"] and pair["obj"][1] in requirement["obj"]
@@ -0,0 +1,120 @@
+import os
+from atomic_file import atomic_write
+
+# Ways to run SpanBERT's classifier on the CPU (see --spanbert-backend)
+spanbert_backends = ["torch", "int8", "onnx"]
+
+
+def spanbert_model_name(backend="torch"):
+    """
+    Model name of a backend in PredictionCache keys, so the predictions of different
+    backends are never mixed up. The torch backend keeps the name older caches used.
+    """
+    if backend == "torch":
+        return "pretrained_spanbert"
+    return f"pretrained_spanbert-{backend}"
+
+
+def load_spanbert(pretrained_dir, backend="torch", threads=None):
+    """
+    Load SpanBERT and swap its classifier (spanbert.model) for the chosen backend:
+        torch  the full-precision PyTorch model, as before
+        int8   the same model with its Linear layers dynamically quantized to int8
+        onnx   the model exported to ONNX (once, next to the weights) and run by onnxruntime
+    predict() is unchanged: tokenization, batching and the softmax still run in spanbert.py.
+    threads sets the intra-op threads of the backend; for torch and int8 it is process-wide.
+    """
+    if backend not in spanbert_backends:
+        raise ValueError(f"Unknown SpanBERT backend: {backend}")
+    if backend == "onnx":
+        # Optional dependencies (not in requirements.txt), checked before the model is loaded
+        try:
+            import onnx
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError(f"--spanbert-backend onnx needs the onnx and onnxruntime packages "
+                              f"(pip3 install onnx onnxruntime): {e}") from e
+
+    # Imported here so that runs that never use SpanBERT don't pay for torch
+    import torch
+    from spanbert import SpanBERT
+
+    if threads:
+        torch.set_num_threads(threads)
+    spanbert = SpanBERT(pretrained_dir)
+    if backend == "torch":
+        return spanbert
+
+    # Both optimized backends are CPU runtimes
+    spanbert.model.to("cpu")
+    if hasattr(spanbert, "device"):
+        spanbert.device = torch.device("cpu")
+
+    if backend == "int8":
+        spanbert.model = torch.quantization.quantize_dynamic(spanbert.model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        onnx_path = os.path.join(pretrained_dir, "spanbert.onnx")
+        if not os.path.exists(onnx_path):
+            print(f"Exporting SpanBERT to {onnx_path} ...")
+            export_onnx(spanbert.model, onnx_path)
+        spanbert.model = OnnxClassifier(onnx_path, threads)
+    return spanbert
+
+
+def export_onnx(model, path, max_seq_length=128):
+    """
+    Export a BertForSequenceClassification to ONNX with dynamic batch and sequence axes.
+    Written atomically, so an interrupted export never leaves a broken model.
+    """
+    import torch
+
+    model.eval()
+    dummy = torch.zeros((1, max_seq_length), dtype=torch.long)
+    axes = {0: "batch", 1: "sequence"}
+    with torch.no_grad(), atomic_write(path, "wb") as f:
+        torch.onnx.export(
+            model, (dummy, dummy, torch.ones_like(dummy)), f,
+            input_names=["input_ids", "token_type_ids", "attention_mask"], output_names=["logits"],
+            dynamic_axes={"input_ids": axes, "token_type_ids": axes, "attention_mask": axes, "logits": {0: "batch"}},
+            opset_version=14,
+        )
+
+
+class OnnxClassifier:
+    """
+    Stand-in for SpanBERT's torch classifier that runs the exported model in onnxruntime.
+    It is called like BertForSequenceClassification (input_ids, token_type_ids,
+    attention_mask) and returns the logits as a torch tensor.
+    """
+
+    def __init__(self, path, threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids, token_type_ids=None, attention_mask=None, labels=None):
+        import torch
+
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        inputs = {
+            "input_ids": input_ids.cpu().numpy(),
+            "token_type_ids": token_type_ids.cpu().numpy(),
+            "attention_mask": attention_mask.cpu().numpy(),
+        }
+        logits, = self.session.run(["logits"], inputs)
+        return torch.from_numpy(logits)
+
+    # The torch model calls spanbert.py may make
+    def to(self, *args, **kwargs):
+        return self
+
+    def eval(self):
+        return self
@@ -1,12 +1,37 @@
-import spacy
-from spanbert import SpanBERT
-from spacy_help_functions import get_entities, create_entity_pairs
+from prediction_cache import PredictionCache
+from spacy_help_functions import matches_requirement
+from instrumentation import metrics
 
-# 1) updated results (in a list or dictionary)
-# 2) updated count of total extractions (including the duplicates)
-def extract_relations_spanbert(spanbert, candidate_pairs, input_tokens, results, total_extracted, t, target_r):
-    relation_preds = spanbert.predict(candidate_pairs)  # get predictions: list of (relation, confidence) pairs
+# Key of a candidate pair's prediction in the PredictionCache. SpanBERT predicts the argmax over
+# every relation label at once, so the target relation is not part of the key.
+def spanbert_cache_key(pair, model_name="pretrained_spanbert"):
+    return PredictionCache.key("spanbert", "*", model_name, [pair["tokens"], pair["subj"], pair["obj"]])
 
+
+def predict_with_cache(spanbert, candidate_pairs, cache=None, model_name="pretrained_spanbert"):
+    """
+    spanbert.predict() that only runs the model on pairs missing from the PredictionCache.
+    """
+    if cache is None:
+        metrics.count("spanbert_pairs", len(candidate_pairs))
+        with metrics.stage("spanbert"):
+            return spanbert.predict(candidate_pairs)
+
+    keys = [spanbert_cache_key(pair, model_name) for pair in candidate_pairs]
+    relation_preds = [cache.get(key) for key in keys]
+    missing = [i for i, pred in enumerate(relation_preds) if pred is None]
+    if missing:
+        metrics.count("spanbert_pairs", len(missing))
+        with metrics.stage("spanbert"):
+            new_preds = spanbert.predict([candidate_pairs[i] for i in missing])
+        for i, pred in zip(missing, new_preds):
+            relation_preds[i] = (pred[0], float(pred[1]))
+        cache.put_many([(keys[i], relation_preds[i]) for i in missing])
+    return [tuple(pred) for pred in relation_preds]
+
+
+# Apply the threshold and duplicate checks to the predictions made for one sentence
+def add_spanbert_predictions(candidate_pairs, relation_preds, input_tokens, results, total_extracted, t, target_r):
     total_extracted += len(relation_preds)
 
     # Print Extracted Relations
@@ -37,7 +62,87 @@ def extract_relations_spanbert(spanbert, candidate_pairs, input_tokens, results,
             print("\t\tAdding to set of extracted relations")
         print("\t\t==========")
     # print("\n")
-    
-    # Sort results
-    results = dict(sorted(results.items(), key=lambda item: item[1], reverse=True))
+
     return results, total_extracted
+
+
+# Offer the predictions made for one sentence to every target relation. targets is a list of
+# (target_r, requirement, results); each relation only sees the pairs whose entity types match
+# its requirement. SpanBERT predicts one label per pair, so the pairs are only predicted once.
+def route_spanbert_predictions(candidate_pairs, relation_preds, input_tokens, targets, total_extracted, t):
+    total_extracted += len(relation_preds)
+    for target_r, requirement, results in targets:
+        routed = [(pair, pred) for pair, pred in zip(candidate_pairs, relation_preds) if matches_requirement(pair, requirement)]
+        if routed:
+            pairs, preds = zip(*routed)
+            add_spanbert_predictions(list(pairs), list(preds), input_tokens, results, 0, t, target_r)
+    return total_extracted
+
+
+class SpanBERTBatcher:
+    """
+    Collect candidate pairs from many sentences (a whole page or a whole iteration) and run
+    them through SpanBERT in large batches instead of one small predict() call per sentence.
+
+    Pairs are sorted by token length before batching so each batch pads to a similar length.
+    Predictions are then put back in their original sentence order and go through the same
+    threshold and duplicate checks as route_spanbert_predictions(), so results are the same.
+    """
+
+    def __init__(self, spanbert, batch_size=64, cache=None, model_name="pretrained_spanbert"):
+        self.spanbert = spanbert
+        self.batch_size = batch_size
+        self.cache = cache
+        self.model_name = model_name  # model name in the cache keys (see spanbert_model_name())
+        self.pending = []  # [(candidate_pairs, input_tokens, provenance), ...] in sentence order
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, candidate_pairs, input_tokens, provenance=None):
+        """
+        Queue the candidate pairs of one sentence. provenance is e.g. (url, sentence index).
+        """
+        self.pending.append((candidate_pairs, input_tokens, provenance))
+
+    def predict_all(self):
+        """
+        Run SpanBERT on every queued pair and return one list of predictions per queued sentence.
+        Pairs already in the PredictionCache are not sent to the model.
+        """
+        preds = [[None] * len(pairs) for pairs, _, _ in self.pending]
+        flat = []
+        for i, (pairs, _, _) in enumerate(self.pending):
+            for j, pair in enumerate(pairs):
+                cached = self.cache.get(spanbert_cache_key(pair, self.model_name)) if self.cache is not None else None
+                if cached is not None:
+                    preds[i][j] = tuple(cached)
+                else:
+                    flat.append((i, j))
+        flat.sort(key=lambda ij: len(self.pending[ij[0]][0][ij[1]]["tokens"]))
+
+        for start in range(0, len(flat), self.batch_size):
+            batch = flat[start:start + self.batch_size]
+            batch_pairs = [self.pending[i][0][j] for i, j in batch]
+            metrics.count("spanbert_pairs", len(batch_pairs))
+            with metrics.stage("spanbert"):
+                batch_preds = self.spanbert.predict(batch_pairs)
+            for (i, j), pred in zip(batch, batch_preds):
+                preds[i][j] = pred
+            if self.cache is not None:
+                self.cache.put_many([(spanbert_cache_key(pair, self.model_name), (pred[0], float(pred[1]))) for pair, pred in zip(batch_pairs, batch_preds)])
+        return preds
+
+    def flush(self, targets, total_extracted, t):
+        """
+        Predict everything queued, apply threshold/dedup in sentence order for every
+        (target_r, requirement, results) in targets and clear the queue.
+        """
+        if not self.pending:
+            return total_extracted
+
+        preds = self.predict_all()
+        for (candidate_pairs, input_tokens, _), relation_preds in zip(self.pending, preds):
+            total_extracted = route_spanbert_predictions(candidate_pairs, relation_preds, input_tokens, targets, total_extracted, t)
+        self.pending = []
+        return total_extracted
@@ -0,0 +1,367 @@
+import codecs
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html.entities import html5
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup
+import requests
+from requests.adapters import HTTPAdapter
+from instrumentation import metrics
+
+headers = {'User-Agent': 'Mozilla/5.0'}
+
+# Tags whose whole subtree is dropped before extracting text
+unwanted_tags = ["script", "style", "header", "footer", "nav", "aside"]
+
+# Tags that never have children (they are never pushed on the open-tag stack)
+void_tags = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+
+# Named entities without their trailing semicolon, resolved the way BeautifulSoup does
+entity_to_character = {}
+for name, character in sorted(html5.items()):
+    entity_to_character.setdefault(name[:-1] if name.endswith(";") else name, character)
+
+
+def make_session(max_workers=10):
+    """
+    Create a requests Session that keeps connections alive and pools them per host,
+    so the fetch workers can reuse sockets instead of opening a new one for every URL.
+    """
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def html_to_text(html, max_length=10000):
+    """
+    Extract plain text from html using BeautifulSoup. Truncate text to max_length if necessary
+    (silently: see print_trimming()).
+    """
+    # Parse the HTML file
+    soup = BeautifulSoup(html, "html.parser")
+
+    # Remove common unwanted tags
+    for tag in soup.find_all(unwanted_tags):
+        tag.decompose()
+
+    # Extract plain text from the HTML
+    raw_text = soup.get_text(separator=" ", strip=True)
+
+    # Removing redundant whitespace
+    raw_text = re.sub('\t', ' ', raw_text)
+    raw_text = re.sub('\n', ' ', raw_text)
+    raw_text = re.sub(' +', ' ', raw_text)
+
+    # Truncate text if it's longer than max_length characters
+    return raw_text[:max_length]
+
+
+def print_trimming(length, max_length):
+    """
+    Report a page whose length characters of text were truncated to max_length. Pages are
+    cleaned in the fetch threads, which may print into another batch job's log, so the run's
+    own thread calls this when it receives the page.
+    """
+    if length > max_length:
+        print(f"\tTrimming webpage content from {length} to {max_length} characters")
+
+
+class StreamingTextExtractor(HTMLParser):
+    """
+    Incremental html-to-text converter producing the same text as html_to_text().
+
+    Html is fed in chunks; text inside unwanted_tags subtrees is skipped on the fly, every
+    text node is stripped and has its whitespace collapsed as it arrives, and `done` becomes
+    True as soon as more than max_length characters of text exist so the caller can stop
+    reading the page.
+    """
+
+    def __init__(self, max_length=10000):
+        # Character references are resolved by hand, like BeautifulSoup's html.parser builder does
+        super().__init__(convert_charrefs=False)
+        self.max_length = max_length
+        self.parts = []
+        self.length = 0
+        self.done = False
+        self.stack = []  # open tags, popped the same way BeautifulSoup's tree builder does
+        self.closed_void_tags = []  # void tags opened as <br>, whose stray </br> is ignored like BeautifulSoup does
+        self.skip_depth = 0  # number of unwanted tags currently open
+        self.pending = []  # pieces of the current text node (it can be split across chunks)
+
+    def handle_starttag(self, tag, attrs):
+        self.end_text()
+        if tag in void_tags:
+            self.closed_void_tags.append(tag)
+            return
+        self.stack.append(tag)
+        if tag in unwanted_tags:
+            self.skip_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.end_text()
+        # BeautifulSoup closes <br/> with an end tag, which uses up an earlier <br>'s ignored </br>
+        if tag in self.closed_void_tags:
+            self.closed_void_tags.remove(tag)
+
+    def handle_endtag(self, tag):
+        # The end tag of a void tag that is already closed doesn't end the text node
+        if tag in self.closed_void_tags:
+            self.closed_void_tags.remove(tag)
+            return
+        self.end_text()
+        # An end tag closes the most recent matching open tag and everything opened after it;
+        # end tags without a matching open tag are ignored
+        if tag not in self.stack:
+            return
+        while self.stack:
+            open_tag = self.stack.pop()
+            if open_tag in unwanted_tags:
+                self.skip_depth -= 1
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.skip_depth and not self.done:
+            self.pending.append(data)
+
+    def handle_entityref(self, name):
+        # Unknown entities are kept as literal text (without their semicolon)
+        self.handle_data(entity_to_character.get(name, "&%s" % name))
+
+    def handle_charref(self, name):
+        if name.startswith(("x", "X")):
+            code = int(name.lstrip("xX"), 16)
+        else:
+            code = int(name)
+
+        data = None
+        if code < 256:
+            # Numeric references below 256 are often meant as windows-1252
+            try:
+                data = bytearray([code]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(code)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_comment(self, data):
+        self.end_text()
+
+    def handle_decl(self, decl):
+        self.end_text()
+
+    def handle_pi(self, data):
+        self.end_text()
+
+    def unknown_decl(self, data):
+        # <![CDATA[...]]> sections are text, like BeautifulSoup's CData strings
+        self.end_text()
+        if data.upper().startswith("CDATA["):
+            self.handle_data(data[len("CDATA["):])
+            self.end_text()
+
+    def close(self):
+        super().close()
+        self.end_text()
+
+    def end_text(self):
+        """
+        Add the text node collected so far: stripped and with its whitespace collapsed.
+        """
+        if not self.pending:
+            return
+        text = "".join(self.pending).strip()
+        self.pending = []
+        if not text:
+            return
+        text = re.sub(' +', ' ', text.replace('\t', ' ').replace('\n', ' '))
+        if self.parts:
+            self.length += 1
+        self.parts.append(text)
+        self.length += len(text)
+        if self.length > self.max_length:
+            self.done = True
+
+    def text(self):
+        return " ".join(self.parts)[:self.max_length]
+
+
+def streaming_html_to_text(chunks, max_length=10000):
+    """
+    Extract plain text from an iterable of html string chunks, stopping as soon as
+    max_length characters of text exist. Returns (text, html read so far, length of the
+    text extracted before truncating it).
+    """
+    extractor = StreamingTextExtractor(max_length)
+    html_parts = []
+    for chunk in chunks:
+        html_parts.append(chunk)
+        extractor.feed(chunk)
+        if extractor.done:
+            break
+    else:
+        extractor.close()
+    return extractor.text(), "".join(html_parts), extractor.length
+
+
+def decoded_chunks(response, chunk_size=16384):
+    """
+    Decode a streamed response body incrementally using the charset from its headers.
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def extract_plain_text(url, max_length=10000, session=None, cache=None, stream=False):
+    """
+    Retrieve the webpage. Skip if there's an error. Extract plain text using BeautifulSoup.
+    Truncate text to max_length if necessary.
+
+    Returns (text, length of the text before truncating it), or None if the page could not
+    be retrieved.
+
+    If a PageCache is given, fresh cached pages are returned without any network call or
+    html parsing, and stale ones are revalidated with If-None-Match / If-Modified-Since.
+
+    With stream=True the body is read in chunks through StreamingTextExtractor and the
+    download stops once max_length characters of text have been extracted.
+    """
+    cached = cache.get(url) if cache is not None else None
+    if cached is not None and not covers(cached, max_length):
+        cached = None
+    if cached is not None and cache.is_fresh(cached):
+        cache.count(hits=1)
+        return cached_text(cache, cached, max_length)
+
+    request_headers = dict(headers)
+    if cached is not None:
+        if cached.etag:
+            request_headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            request_headers['If-Modified-Since'] = cached.last_modified
+
+    client = session if session is not None else requests
+    try:
+        with metrics.stage("fetch"):
+            response = client.get(url, timeout=10, headers=request_headers, stream=stream)
+        response.raise_for_status()
+    except Exception as e:
+        # print(f"Skipping URL {url} due to retrieval error: {e}")
+        # print(e)
+        metrics.count("pages_failed")
+        return None
+
+    # The page hasn't changed since we cached it
+    if cached is not None and response.status_code == 304:
+        response.close()
+        cache.count(revalidated=1)
+        cache.refresh(url, response.headers)
+        return cached_text(cache, cached, max_length)
+
+    # With stream=True, the time spent reading the body is part of html_parse
+    if stream:
+        try:
+            with metrics.stage("html_parse"):
+                raw_text, html, length = streaming_html_to_text(decoded_chunks(response), max_length)
+        except Exception as e:
+            metrics.count("pages_failed")
+            return None
+        finally:
+            response.close()
+    else:
+        html = response.text
+        with metrics.stage("html_parse"):
+            # The text is never longer than the html, so this keeps all of it
+            raw_text = html_to_text(html, len(html))
+        length = len(raw_text)
+        raw_text = raw_text[:max_length]
+    metrics.count("pages_downloaded")
+    metrics.count("html_chars", len(html))
+
+    if cache is not None:
+        cache.count(misses=1)
+        cache.put(url, html, raw_text, max_length,
+                  response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+    return raw_text, length
+
+
+def covers(cached, max_length):
+    """
+    Whether a cached page can produce max_length characters of text. Streamed pages only
+    store the html read until their own max_length was reached.
+    """
+    return cached.max_length >= max_length or len(cached.text) < cached.max_length
+
+
+def cached_text(cache, cached, max_length):
+    """
+    Return (text, length before truncation) of a cached page like extract_plain_text(),
+    re-parsing the stored html only if the page was cached with a different max_length.
+    The entry is only rewritten for a larger max_length, so runs alternating lengths don't
+    keep replacing it (and a longer text is never replaced by a shorter one).
+    """
+    if cached.max_length == max_length:
+        return cached.text, len(cached.text)
+    raw_text = html_to_text(cached.html, len(cached.html))
+    if max_length > cached.max_length:
+        cache.put(cached.url, cached.html, raw_text[:max_length], max_length, cached.etag, cached.last_modified, cached.fetched_at)
+    return raw_text[:max_length], len(raw_text)
+
+
+def fetch_pages(urls, session=None, max_workers=10, cache=None, stream=False, pool=None, max_length=10000):
+    """
+    Fetch and clean every url in parallel using a bounded thread pool.
+
+    Parameters:
+        urls (list): URLs to fetch. Callers are responsible for deduplicating them.
+        session (requests.Session): Shared session used for connection pooling.
+        max_workers (int): Maximum number of requests in flight at once.
+        cache (PageCache): Optional on-disk page cache shared by all workers.
+        stream (bool): Stream and parse page bodies incrementally (see extract_plain_text()).
+        pool (SharedMemo): Optional in-memory pool of pages shared by concurrent runs; a url
+            already fetched (or being fetched) by another run is not downloaded again.
+        max_length (int): Characters of text kept per page (see extract_plain_text()).
+
+    Yields:
+        tuple: (url, text) in the order the pages finish downloading. text is None
+        if the page could not be retrieved. Closing the generator cancels the downloads
+        that have not started yet. Trimmed pages are reported here, on the caller's thread.
+    """
+    if not urls:
+        return
+    if session is None:
+        session = make_session(max_workers)
+
+    def fetch(url):
+        if pool is None:
+            return extract_plain_text(url, max_length, session=session, cache=cache, stream=stream)
+        return pool.get((url, max_length), lambda: extract_plain_text(url, max_length, session=session, cache=cache, stream=stream))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(fetch, url): url for url in urls}
+        for future in as_completed(futures):
+            page = future.result()
+            if page is None:
+                yield futures[future], None
+                continue
+            text, length = page
+            print_trimming(length, max_length)
+            yield futures[future], text
+    finally:
+        # If the caller stops early (ex. k tuples reached), downloads that haven't started are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,182 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from models import Models
+from prediction_cache import PredictionCache
+from spacy_help_functions import create_candidate_pairs
+from spanbert_process import SpanBERTBatcher
+from dedup import sentence_key
+from chunking import PageBudget, budgeted, chunked_sentences
+from instrumentation import metrics, Metrics
+
+# Models and settings of the current worker process, set up once by init_worker()
+_worker = {}
+
+
+def init_worker(spanbert_dir, spacy_fast, backend, threads, batch_size, model_name, entities_of_interest, cache_path=None, cache_lru=10000,
+                chunk_chars=None, max_sentences=None, max_seconds=None):
+    models = Models(spanbert_dir)
+    _worker["nlp"] = models.nlp(spacy_fast)
+    _worker["spanbert"] = models.spanbert(backend, threads)
+    _worker["batch_size"] = batch_size
+    _worker["model_name"] = model_name
+    _worker["entities_of_interest"] = entities_of_interest
+    _worker["cache"] = PredictionCache(cache_path, lru_size=cache_lru) if cache_path else None
+    _worker["chunk_chars"] = chunk_chars
+    _worker["budget"] = (max_sentences, max_seconds)
+    # Every page reports its stage timings; the coordinator only adds them up with --metrics
+    metrics.enable()
+
+
+def predict_chunk(batcher, chunk, budget):
+    """
+    Predict the pairs batcher queued for chunk ([(sentence key, input tokens, candidate
+    pairs), ...]) as one SpanBERT batch. Returns the chunk's (sentence key, input tokens,
+    candidate pairs, predictions) and the number of sentences with candidate pairs that were
+    left out because the page's time budget ran out first.
+    """
+    if not chunk:
+        return [], 0
+    if budget.out_of_time():
+        batcher.pending = []
+        return [(key, input_tokens, [], []) for key, input_tokens, candidate_pairs in chunk if not candidate_pairs], \
+            sum(1 for _, _, candidate_pairs in chunk if candidate_pairs)
+    preds = iter(batcher.predict_all())
+    batcher.pending = []
+    return [(key, input_tokens, candidate_pairs, next(preds) if candidate_pairs else [])
+            for key, input_tokens, candidate_pairs in chunk], 0
+
+
+def extract_page(text, requirements):
+    """
+    Annotate one page (chunk by chunk with --page-chunk-chars, within the page budget) and
+    predict every candidate pair of its sentences that fits one of the entity type
+    requirements (as one SpanBERT batch per chunk, or per batch of pairs under a time budget,
+    which is checked before each batch). Runs in a worker process. Returns the
+    page's sentences as (sentence key, input tokens, candidate pairs, predictions), plus the
+    prediction cache hits and misses and the stage timings and counts of the page, for the
+    coordinator to merge.
+    """
+    cache = _worker["cache"]
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    before = metrics.snapshot()
+
+    if _worker["chunk_chars"]:
+        page_sentences = chunked_sentences(_worker["nlp"], text, _worker["chunk_chars"])
+    else:
+        with metrics.stage("spacy"):
+            page_sentences = _worker["nlp"](text).sents
+    budget = PageBudget(*_worker["budget"])
+    batcher = SpanBERTBatcher(_worker["spanbert"], _worker["batch_size"], cache, _worker["model_name"])
+    page = []
+    chunk = []
+    current_doc = None
+    dropped = 0
+    queued = 0  # pairs in the batcher
+    for sentence in budgeted(page_sentences, budget):
+        # Predict each chunk before the next one is annotated (and, under a time budget, every
+        # full batch of pairs), within the time budget
+        if sentence.doc is not current_doc or (budget.max_seconds is not None and queued >= _worker["batch_size"]):
+            predicted, chunk_dropped = predict_chunk(batcher, chunk, budget)
+            page.extend(predicted)
+            dropped += chunk_dropped
+            chunk = []
+            queued = 0
+            current_doc = sentence.doc
+        with metrics.stage("candidate_pairs"):
+            candidate_pairs = create_candidate_pairs(sentence, _worker["entities_of_interest"], requirements)
+        input_tokens = [token.text for token in sentence]
+        chunk.append((sentence_key(sentence), input_tokens, candidate_pairs))
+        if candidate_pairs:
+            batcher.add(candidate_pairs, input_tokens)
+            queued += len(candidate_pairs)
+    predicted, chunk_dropped = predict_chunk(batcher, chunk, budget)
+    page.extend(predicted)
+    dropped += chunk_dropped
+    if dropped:
+        metrics.count("budget_dropped_sentences", dropped)
+
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return {"sentences": page, "cache_hits": hits, "cache_misses": misses, "budget_stopped": budget.stopped,
+            "budget_dropped": dropped, "metrics": Metrics.diff(metrics.snapshot(), before)}
+
+
+class WorkerPool:
+    """
+    Worker processes that each load spaCy and SpanBERT once and turn page texts into
+    candidate-level SpanBERT predictions (see --workers). The coordinator keeps the ISE state
+    and merges what the workers return. Relations and the threshold are per call, so runs
+    sharing one ISEResources (batch.py) share one pool.
+
+    extract_pages() hands every page to the pool as soon as it is downloaded, but yields the
+    results in the fixed order of the iteration's urls, so results and output don't depend
+    on the number of workers or on which download or worker finished first.
+    """
+
+    def __init__(self, num_workers, initargs):
+        self.settings = (num_workers, initargs)
+        # spawn rather than fork: torch and the fetch threads don't survive a fork
+        context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+                                             initializer=init_worker, initargs=initargs)
+
+    def extract_pages(self, pages, order, skipped, requirements):
+        """
+        pages yields (text, url) tuples of the urls in order; skipped holds the urls of order
+        that were dropped before reaching the pool (failed downloads, duplicates). Yields
+        (page, url) in the order of order.
+        """
+        futures = {}
+        position = 0
+        try:
+            for text, url in pages:
+                futures[url] = self._executor.submit(extract_page, text, requirements)
+                # Pass on the results that are next in order and already done
+                while position < len(order):
+                    next_url = order[position]
+                    if next_url in skipped:
+                        position += 1
+                    elif next_url in futures and futures[next_url].done():
+                        position += 1
+                        yield self._result(futures.pop(next_url)), next_url
+                    else:
+                        break
+
+            # Every page has been handed out; wait for the rest in order
+            for url in order[position:]:
+                if url in futures:
+                    yield self._result(futures.pop(url)), url
+        finally:
+            # The caller stopped early (ex. --stop-early)
+            for future in futures.values():
+                future.cancel()
+
+    @staticmethod
+    def _result(future):
+        with metrics.stage("worker_wait"):
+            return future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ResidentWorkerPool:
+    """
+    One WorkerPool kept alive between runs, next to the models of daemon.py, so a --workers
+    job doesn't start (and load the models in) new processes. A job asking for other worker
+    settings (ex. another --spanbert-backend or number of workers) replaces the pool.
+    """
+
+    def __init__(self):
+        self._pool = None
+
+    def get(self, num_workers, initargs):
+        if self._pool is None or self._pool.settings != (num_workers, initargs):
+            self.close()
+            self._pool = WorkerPool(num_workers, initargs)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None